@@ -1,39 +1,27 @@
 import streamlit as st
 import pandas as pd
-import geopandas as gpd
 import pydeck as pdk
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.cm as cm
-import matplotlib.colors as mcolors
-import matplotlib.colorbar as mcolorbar
-import io
-import base64
-from geopy.geocoders import Nominatim
+from roadkill.config import (
+    CSV_PATH, SECTIONS_SHP_PATH, CSV_ROUTE_NAME_COL, CSV_WEATHER_COL, CSV_ANIMAL_COL, CSV_MONTH_COL, CSV_HOUR_COL,
+    CSV_DAY_OF_WEEK_COL, FILTER_COLS, ROUTE_NAME_COL, SHP_START_IC_COL, SHP_END_IC_COL,
+)
+from roadkill.cube import CountCube
+from roadkill.styling import density_per_km, density_colors, render_template
+from roadkill.legend import legend_html
+from roadkill.geometry import PathIndex, build_path_levels, build_route_paths, pick_tolerance, view_bounds
+from roadkill.geocode import default_geocoder
+from roadkill.hotspots import HotspotEngine
+from roadkill.spatial import linear_reference
+from roadkill.pipeline import load_map_sections
+from roadkill.store import source_fingerprint
+from roadkill.profiling import Tracer, DEBUG_ENABLED
 
 # --- アプリケーションの基本設定 ---
 st.set_page_config(layout="wide", page_title="R5年度ロードキルマップ")
 
 # --- 1. 設定項目 ---
-CSV_PATH = '上下区別なし_R5.4～R6.3路上障害物（ロードキル）.csv'
-SECTIONS_SHP_PATH = 'final_highway_sections_with_ic.shp' 
-
-# CSVの列名
-# ★★★ 指示通りに変更 ★★★
-CSV_OFFICIAL_NAME_COL = '正式名称' 
-CSV_ROUTE_NAME_COL = '道路名' # ツールチップ表示用の通称を追加
-CSV_SECTION_NAME_COL = '区間'
-CSV_DIRECTION_COL = '上下'
-CSV_WEATHER_COL = '排除時天候'
-CSV_ANIMAL_COL = '小分類'
-CSV_MONTH_COL = '月'
-CSV_HOUR_COL = '時'
-CSV_DAY_OF_WEEK_COL = '曜'
-CSV_LENGTH_COL = '区間長_km' 
-
-# シェープファイルの列名
-SHP_START_IC_COL = 'start_IC' 
-SHP_END_IC_COL = 'end_IC'
+# 入力ファイルと列名は roadkill/config.py で指定する
 
 # 地図設定
 INITIAL_VIEW_STATE = pdk.ViewState(
@@ -42,76 +30,105 @@ INITIAL_VIEW_STATE = pdk.ViewState(
     zoom=5.5, 
     pitch=0
 )
+# ズームがこれより小さい（広域の）表示では、区間ではなく路線ごとにまとめた線を送る
+ROUTE_VIEW_MAX_ZOOM = 7.0
 
-# --- 2. 補助関数 ---
-def normalize_name(name):
-    if not isinstance(name, str): return ""
-    name = name.translate(str.maketrans({chr(0xFF01 + i): chr(0x21 + i) for i in range(94)}))
-    name = name.replace('　', ' ')
-    return name.strip()
+# ツールチップ（区間長が分からない区間は件数だけを表示する）
+TOOLTIP_TEMPLATE = ("<b>路線名:</b> {道路名}<br/>"
+                    "<b>区間:</b> {start_IC}〜{end_IC}<br/>"
+                    "<b>1kmあたり件数:</b> {件数_per_km:.2f} 件/km<br/>"
+                    "<b>合計件数:</b> {件数} 件<br/>"
+                    "<b>区間長:</b> {区間長_km:.1f} km")
+TOOLTIP_TEMPLATE_NO_LENGTH = "<b>路線名:</b> {道路名}<br/><b>区間:</b> {start_IC}〜{end_IC}<br/>件数: {件数} 件"
+ROUTE_TOOLTIP_TEMPLATE = ("<b>路線名:</b> {路線名}<br/>"
+                          "<b>1kmあたり件数:</b> {件数_per_km:.2f} 件/km<br/>"
+                          "<b>合計件数:</b> {件数} 件<br/>"
+                          "<b>路線長:</b> {路線長_km:.1f} km<br/>"
+                          "（地名検索や表の行の選択で移動すると区間ごとに表示します）")
 
-def get_color(value, max_value):
-    if value <= 0: return [200, 200, 200, 40] 
-    norm = mcolors.Normalize(vmin=0, vmax=max_value if max_value > 0 else 1)
-    cmap = cm.get_cmap('coolwarm')
-    rgba = cmap(norm(value))
-    return [int(c * 255) for c in rgba[:3]] + [200]
-    
-def create_legend_image(max_value):
-    try:
-        plt.rcParams['font.family'] = 'MS Gothic'
-    except:
-        plt.rcParams['font.family'] = 'sans-serif'
-    fig, ax = plt.subplots(figsize=(3, 0.35)) 
-    fig.subplots_adjust(bottom=0.5)
-    cmap = plt.get_cmap('coolwarm')
-    norm = mcolors.Normalize(vmin=0, vmax=max_value if max_value > 0 else 1)
-    cb = mcolorbar.ColorbarBase(ax, cmap=cmap, norm=norm, orientation='horizontal')
-    cb.set_label('1kmあたりの件数', fontsize=8) 
-    cb.ax.tick_params(labelsize=7)
-    buf = io.BytesIO()
-    fig.savefig(buf, format='png', bbox_inches='tight', pad_inches=0.1, transparent=True)
-    buf.seek(0)
-    img_str = base64.b64encode(buf.read()).decode()
-    plt.close(fig)
-    legend_html = f'''
-    <div style="position: absolute; bottom: 50px; right: 20px; z-index: 1000;">
-        <div style="background-color: white; border-radius: 8px; padding: 8px; border: 1px solid #ccc; font-size: 10px; text-align: center; box-shadow: 0 4px 8px rgba(0,0,0,0.1);">
-            <img src="data:image/png;base64,{img_str}" style="width: 100%;">
-        </div>
-    </div>'''
-    return legend_html
+# 色分けの指標（表示名: (列名, 凡例の見出し, ツールチップに足す行, 表に足す列)）
+# 推定率は路線平均への経験ベイズ縮小、カーネル密度は路線に沿って件数をならした値（roadkill.hotspots）
+COLOR_METRICS = {
+    '1kmあたり件数': ('件数_per_km', '1kmあたりの件数', "", []),
+    '推定率（経験ベイズ）': ('推定率', '推定率（件/km）', "<br/><b>推定率:</b> {推定率:.2f} 件/km（路線平均 {基準率:.2f}）",
+                     ['推定率', '期待件数', 'q値', 'ホットスポット']),
+    'カーネル密度（路線沿い）': ('カーネル密度', 'カーネル密度（件/km）', "<br/><b>カーネル密度:</b> {カーネル密度:.2f} 件/km",
+                      ['カーネル密度']),
+}
 
-# --- 3. データ読み込みと前処理（キャッシュ） ---
-@st.cache_data
-def load_data():
+# --- 2. データ読み込み（キャッシュ） ---
+# 前処理と区間の結合は roadkill.pipeline が行い、結果はディスクに保存される
+# （python -m roadkill.pipeline で事前に作成しておけば、ここでは読むだけになる）
+# 全セッションで共有し、入力ファイルが変わったとき（source_key）だけ読み直す（roadkill.store を参照）
+@st.cache_resource(max_entries=1)
+def load_data(source_key):
     try:
-        roadkill_df = pd.read_csv(CSV_PATH, encoding='utf-8-sig', header=2)
-        sections_gdf = gpd.read_file(SECTIONS_SHP_PATH, encoding='utf-8').to_crs(epsg=4326)
+        frames = load_map_sections(CSV_PATH, SECTIONS_SHP_PATH)
     except Exception as e:
         st.error(f"データ読み込みエラー: {e}"); st.stop()
-    roadkill_df.columns = roadkill_df.columns.str.strip()
-    # ★★★ 指示通りに変更 ★★★
-    required_cols = [CSV_OFFICIAL_NAME_COL, CSV_ROUTE_NAME_COL, CSV_SECTION_NAME_COL, CSV_DIRECTION_COL, CSV_LENGTH_COL]
-    roadkill_df.dropna(subset=required_cols, inplace=True)
-    numeric_cols = [CSV_MONTH_COL, CSV_HOUR_COL, CSV_LENGTH_COL]
-    for col in numeric_cols:
-        roadkill_df[col] = pd.to_numeric(roadkill_df[col], errors='coerce')
-    roadkill_df.dropna(subset=numeric_cols, inplace=True)
-    roadkill_df[CSV_MONTH_COL] = roadkill_df[CSV_MONTH_COL].astype(int)
-    roadkill_df[CSV_HOUR_COL] = roadkill_df[CSV_HOUR_COL].astype(int)
-    roadkill_df['section_norm'] = roadkill_df[CSV_SECTION_NAME_COL].apply(normalize_name)
-    sections_gdf['start_norm'] = sections_gdf[SHP_START_IC_COL].astype(str).apply(normalize_name)
-    sections_gdf['end_norm'] = sections_gdf[SHP_END_IC_COL].astype(str).apply(normalize_name)
-    sections_gdf['section_norm_key_1'] = sections_gdf['start_norm'] + '〜' + sections_gdf['end_norm']
-    sections_gdf['section_norm_key_2'] = sections_gdf['end_norm'] + '〜' + sections_gdf['start_norm']
-    return roadkill_df, sections_gdf
+    # 事故の全行は読まず、パイプラインが作った区間 × フィルタ次元の件数表だけを持つ
+    section_keys = pd.Index(frames['section_keys']['section_key'])
+    return frames['sections'], section_keys, frames['unmatched'], frames['counts']
+
+# 区間 × フィルタ次元の件数キューブ（パイプラインの件数表から一度だけ作る。全件の groupby との照合は作成時に済んでいる）
+@st.cache_resource(max_entries=1)
+def build_count_cube(_counts, _section_keys, source_key):
+    return CountCube(_counts, 'section_id', FILTER_COLS, attr_cols=['区間長_km', CSV_ROUTE_NAME_COL],
+                     sections=pd.RangeIndex(len(_section_keys)), weight_col='件数')
+
+# 地図レイヤ用の簡略化済みパスと、表示範囲で絞り込むための外接矩形の索引（ズーム段階ごとに一度だけ作成）
+@st.cache_resource(max_entries=1)
+def build_layer_paths(_sections_gdf, source_key):
+    return {tolerance: PathIndex(paths) for tolerance, paths in build_path_levels(_sections_gdf.geometry.values).items()}
+
+# 広域表示用の、路線ごとにつないだパス（一度だけ作成）
+# 戻り値は路線のパスの索引、路線名、区間 ID ごとの路線の番号（路線不明は -1）
+@st.cache_resource(max_entries=1)
+def build_route_layer(_sections_gdf, n_sections, source_key):
+    route_codes, route_names = pd.factorize(_sections_gdf[ROUTE_NAME_COL])
+    section_routes = (pd.Series(route_codes).groupby(_sections_gdf['section_id'].to_numpy()).first()
+                      .reindex(range(n_sections), fill_value=-1).to_numpy())
+    return PathIndex(build_route_paths(_sections_gdf.geometry.values, route_codes)), route_names, section_routes
+
+# ホットスポット判定用の区間長・路線と、路線沿いの位置（一度だけ作成）
+# 区間長は CSV の値を使い、CSV にない区間はジオメトリの長さで補う
+@st.cache_resource(max_entries=1)
+def build_hotspot_engine(_sections_gdf, _count_cube, source_key):
+    positions = linear_reference(_sections_gdf.geometry, _sections_gdf[ROUTE_NAME_COL])
+    section_ids = _sections_gdf['section_id'].to_numpy()
+    n_sections = len(_count_cube.sections)
+    geometry_lengths = np.bincount(section_ids, weights=positions['length_km'].to_numpy(), minlength=n_sections)
+    lengths = _count_cube.section_attrs['区間長_km'].to_numpy(dtype=float)
+    lengths = np.where(np.isnan(lengths), geometry_lengths, lengths)
+    routes = pd.Series(_sections_gdf[ROUTE_NAME_COL].to_numpy()).groupby(section_ids).first().reindex(range(n_sections))
+    return HotspotEngine(lengths, routes, section_ids, positions)
+
+# 区間別の件数・推定率・カーネル密度（フィルタ条件ごとにキャッシュ）
+@st.cache_data(max_entries=256)
+def analyze_sections(_count_cube, _hotspot_engine, selections, source_key):
+    counts = _count_cube.counts(selections)
+    return counts, _hotspot_engine.rank(counts), _hotspot_engine.kernel_density(counts)
+
+# 地名検索（同梱データの地名索引。見つからないときだけ Nominatim に問い合わせる）
+# 状態を持つオブジェクトなので複製せず、全セッションで一つを共有する
+@st.cache_resource
+def load_geocoder():
+    return default_geocoder(sections_path=SECTIONS_SHP_PATH)
 
-# --- 4. メイン処理 ---
+# --- 3. メイン処理 ---
 st.title("R5年度ロードキルマップ（合計版）")
 
+# 処理段階ごとの時間・メモリ（?debug=1 か環境変数 ROADKILL_DEBUG=1 のときだけ記録し、サイドバーに表示する）
+tracer = Tracer(DEBUG_ENABLED or st.query_params.get('debug') == '1')
+
 try:
-    roadkill_df, sections_gdf = load_data()
+    with tracer.span('データ読み込み') as span:
+        source_key = source_fingerprint([CSV_PATH, SECTIONS_SHP_PATH])
+        sections_gdf, section_keys, unmatched_df, section_cells = load_data(source_key)
+        count_cube = build_count_cube(section_cells, section_keys, source_key)
+        path_levels = build_layer_paths(sections_gdf, source_key)
+        route_paths, route_names, section_routes = build_route_layer(sections_gdf, len(section_keys), source_key)
+        hotspot_engine = build_hotspot_engine(sections_gdf, count_cube, source_key); span.rows = int(section_cells['件数'].sum())
     
     def reset_all_states():
         st.session_state.view_state = INITIAL_VIEW_STATE
@@ -124,56 +141,57 @@ try:
     filter_mode = st.sidebar.radio("フィルタの選択方法", ('単一選択', '複数選択'), horizontal=True)
     st.sidebar.markdown("---") 
 
-    month_options = sorted(roadkill_df[CSV_MONTH_COL].unique())
-    hour_options = sorted(roadkill_df[CSV_HOUR_COL].unique())
+    # 選択肢は件数キューブの値の一覧から作る（全件の走査はしない）
+    month_options, hour_options = count_cube.options(CSV_MONTH_COL), count_cube.options(CSV_HOUR_COL)
     day_of_week_options = ['月', '火', '水', '木', '金', '土', '日']
-    weather_options = sorted([w for w in roadkill_df[CSV_WEATHER_COL].unique() if pd.notna(w)])
-    animal_options = sorted([a for a in roadkill_df[CSV_ANIMAL_COL].unique() if pd.notna(a)])
+    weather_options, animal_options = count_cube.options(CSV_WEATHER_COL), count_cube.options(CSV_ANIMAL_COL)
 
-    filtered_df = roadkill_df.copy()
     if filter_mode == '単一選択':
         selected_month = st.sidebar.selectbox("月を選択", options=['すべて'] + month_options)
         selected_hour = st.sidebar.selectbox("時間帯を選択", options=['すべて'] + hour_options)
         selected_day_of_week = st.sidebar.selectbox("曜日を選択", options=['すべて'] + day_of_week_options)
         selected_weather = st.sidebar.selectbox("天候を選択", options=['すべて'] + weather_options)
         selected_animal = st.sidebar.selectbox("動物の種類を選択", options=['すべて'] + animal_options)
-        if selected_month != 'すべて': filtered_df = filtered_df[filtered_df[CSV_MONTH_COL] == selected_month]
-        if selected_hour != 'すべて': filtered_df = filtered_df[filtered_df[CSV_HOUR_COL] == selected_hour]
-        if selected_day_of_week != 'すべて': filtered_df = filtered_df[filtered_df[CSV_DAY_OF_WEEK_COL] == selected_day_of_week]
-        if selected_weather != 'すべて': filtered_df = filtered_df[filtered_df[CSV_WEATHER_COL] == selected_weather]
-        if selected_animal != 'すべて': filtered_df = filtered_df[filtered_df[CSV_ANIMAL_COL] == selected_animal]
+        selections = {CSV_MONTH_COL: selected_month, CSV_HOUR_COL: selected_hour, CSV_DAY_OF_WEEK_COL: selected_day_of_week,
+                      CSV_WEATHER_COL: selected_weather, CSV_ANIMAL_COL: selected_animal}
+        selections = {col: value for col, value in selections.items() if value != 'すべて'}
     else:
         selected_months = st.sidebar.multiselect("月を選択", options=month_options, default=month_options)
         selected_hours = st.sidebar.multiselect("時間帯を選択", options=hour_options, default=hour_options)
         selected_days_of_week = st.sidebar.multiselect("曜日を選択", options=day_of_week_options, default=day_of_week_options)
         selected_weathers = st.sidebar.multiselect("天候を選択", options=weather_options, default=weather_options)
         selected_animals = st.sidebar.multiselect("動物の種類を選択", options=animal_options, default=animal_options)
-        if selected_months: filtered_df = filtered_df[filtered_df[CSV_MONTH_COL].isin(selected_months)]
-        if selected_hours: filtered_df = filtered_df[filtered_df[CSV_HOUR_COL].isin(selected_hours)]
-        if selected_days_of_week: filtered_df = filtered_df[filtered_df[CSV_DAY_OF_WEEK_COL].isin(selected_days_of_week)]
-        if selected_weathers: filtered_df = filtered_df[filtered_df[CSV_WEATHER_COL].isin(selected_weathers)]
-        if selected_animals: filtered_df = filtered_df[filtered_df[CSV_ANIMAL_COL].isin(selected_animals)]
+        selections = {CSV_MONTH_COL: selected_months, CSV_HOUR_COL: selected_hours, CSV_DAY_OF_WEEK_COL: selected_days_of_week,
+                      CSV_WEATHER_COL: selected_weathers, CSV_ANIMAL_COL: selected_animals}
+
+    st.sidebar.markdown("---")
+    color_metric = st.sidebar.radio("色分けの指標", list(COLOR_METRICS))
+    metric_col, metric_label, metric_tooltip, metric_table_cols = COLOR_METRICS[color_metric]
+    # 路線ごとの色分けは 1kmあたり件数だけ（推定率・カーネル密度は区間ごとの値なので、選んでいるときはまとめない）
+    # ブラウザでの拡大はアプリに伝わらないので、既定ではまとめない
+    can_group_routes = color_metric == '1kmあたり件数'
+    group_routes = st.sidebar.checkbox(
+        "広域表示では路線ごとにまとめる", value=False, disabled=not can_group_routes,
+        help="全国を表示しているときは、区間ではなく路線ごとの1kmあたり件数で色分けします。"
+             "地図をマウスで拡大しても区間ごとの表示には戻らないので、地名検索や表の行の選択で移動してください"
+             + ("" if can_group_routes else "（色分けの指標が「1kmあたり件数」のときだけ使えます）")) and can_group_routes
 
     # --- 集計とデータ結合 ---
-    all_sections_map = sections_gdf.copy()
-    if not filtered_df.empty:
-        # ★★★ 指示通りに変更 ★★★
-        agg_funcs = {
-            '件数': (CSV_SECTION_NAME_COL, 'size'), 
-            '区間長_km': (CSV_LENGTH_COL, 'first'),
-            CSV_ROUTE_NAME_COL: (CSV_ROUTE_NAME_COL, 'first') # 表示用の通称を保持
-        }
-        section_counts = filtered_df.groupby('section_norm').agg(**agg_funcs).reset_index()
-    else:
-        section_counts = pd.DataFrame(columns=['section_norm', '件数', '区間長_km', CSV_ROUTE_NAME_COL])
-        
-    map_gdf_1 = pd.merge(all_sections_map, section_counts, left_on='section_norm_key_1', right_on='section_norm', how='left')
-    map_gdf_2 = pd.merge(all_sections_map, section_counts, left_on='section_norm_key_2', right_on='section_norm', how='left')
-    map_gdf = map_gdf_1
-    map_gdf['件数'] = map_gdf_1['件数'].fillna(map_gdf_2['件数']).fillna(0)
-    map_gdf['区間長_km'] = map_gdf_1['区間長_km'].fillna(map_gdf_2['区間長_km'])
-    map_gdf[CSV_ROUTE_NAME_COL] = map_gdf_1[CSV_ROUTE_NAME_COL].fillna(map_gdf_2[CSV_ROUTE_NAME_COL]) # 通称も結合
-    map_gdf.dropna(subset=['geometry'], inplace=True)
+    # 区間別の件数はキューブのスライスと合計だけで求め、区間 ID で直接割り当てる
+    # （load_data の戻り値は全セッションで共有しているので、列だけの浅いコピーに追加する。ジオメトリは複製しない）
+    with tracer.span('区間別の集計') as span:
+        section_counts, section_rates, kernel_density = analyze_sections(count_cube, hotspot_engine, selections, source_key)
+        span.rows = int(section_counts.sum())
+    with tracer.span('区間への割り当て') as span:
+        map_gdf = sections_gdf.copy(deep=False)
+        section_ids = map_gdf['section_id'].to_numpy()
+        has_count = section_counts[section_ids] > 0
+        map_gdf['件数'] = section_counts[section_ids]
+        for col in ['区間長_km', CSV_ROUTE_NAME_COL]:
+            map_gdf[col] = pd.Series(count_cube.section_attrs[col].to_numpy()[section_ids], index=map_gdf.index).where(has_count)
+        for col in ['基準率', '期待件数', '推定率', 'q値', 'ホットスポット']:
+            map_gdf[col] = section_rates[col].to_numpy()[section_ids]
+        map_gdf['カーネル密度'] = kernel_density; span.rows = len(map_gdf)
 
     # --- 地図連携UI ---
     if "view_state" not in st.session_state:
@@ -185,9 +203,8 @@ try:
     location_query = st.sidebar.text_input("地名を入力して検索", key="location_query_input")
     if st.sidebar.button("検索"):
         if location_query:
-            geolocator = Nominatim(user_agent="roadkill_mapper_app")
             try:
-                location = geolocator.geocode(location_query, country_codes="jp")
+                location = load_geocoder().geocode(location_query)
                 if location:
                     st.session_state.view_state = pdk.ViewState(
                         latitude=location.latitude, longitude=location.longitude,
@@ -201,48 +218,84 @@ try:
         else:
             st.sidebar.warning("地名を入力してください。")
 
+    if not unmatched_df.empty:
+        with st.sidebar.expander(f"地図と結合できなかった区間（{len(unmatched_df)}件）"):
+            st.dataframe(unmatched_df)
+
     st.sidebar.button("地図表示をリセット", on_click=reset_all_states)
 
     map_container = st.container()
 
     if not map_gdf.empty:
-        map_gdf['件数_per_km'] = map_gdf.apply(lambda row: row['件数'] / row['区間長_km'] if pd.notna(row['区間長_km']) and row['区間長_km'] > 0 else 0, axis=1)
-        max_density = map_gdf['件数_per_km'].max()
-        map_gdf['color'] = map_gdf['件数_per_km'].apply(lambda d: get_color(d, max_density))
-        map_gdf['tooltip'] = map_gdf.apply(
-            # ★★★ 指示通りに変更 ★★★
-            lambda row: f"<b>路線名:</b> {row[CSV_ROUTE_NAME_COL]}<br/>"
-                        f"<b>区間:</b> {row[SHP_START_IC_COL]}〜{row[SHP_END_IC_COL]}<br/>"
-                        f"<b>1kmあたり件数:</b> {row['件数_per_km']:.2f} 件/km<br/>"
-                        f"<b>合計件数:</b> {int(row['件数'])} 件<br/>"
-                        f"<b>区間長:</b> {row['区間長_km']:.1f} km" if pd.notna(row['区間長_km']) else f"<b>路線名:</b> {row[CSV_ROUTE_NAME_COL]}<br/><b>区間:</b> {row[SHP_START_IC_COL]}〜{row[SHP_END_IC_COL]}<br/>件数: {int(row['件数'])} 件",
-            axis=1
-        )
+        view_state = st.session_state.view_state
+        route_view = group_routes and view_state.zoom < ROUTE_VIEW_MAX_ZOOM
+        with tracer.span('色・ツールチップ') as span:
+            map_gdf['件数_per_km'] = density_per_km(map_gdf['件数'], map_gdf['区間長_km'])
+            if route_view:
+                # 路線ごとの件数・長さ（区間長が分からない区間はジオメトリの長さ）から 1km あたり件数を求める
+                known = section_routes >= 0
+                route_df = pd.DataFrame({
+                    '路線名': route_names,
+                    '件数': np.bincount(section_routes[known], weights=section_counts[known], minlength=len(route_names)).astype(int),
+                    '路線長_km': np.bincount(section_routes[known], weights=np.nan_to_num(hotspot_engine.lengths[known]),
+                                          minlength=len(route_names)),
+                })
+                route_df['件数_per_km'] = density_per_km(route_df['件数'], route_df['路線長_km'])
+                max_density = route_df['件数_per_km'].max()
+                colors = density_colors(route_df['件数_per_km'].fillna(0), max_density, zero_color=[200, 200, 200, 40])
+                tooltips = render_template(ROUTE_TOOLTIP_TEMPLATE, route_df).to_numpy()
+                metric_label = '路線の1kmあたりの件数'
+            else:
+                max_density = map_gdf[metric_col].max()
+                colors = density_colors(map_gdf[metric_col].fillna(0), max_density, zero_color=[200, 200, 200, 40])
+                tooltips = render_template(TOOLTIP_TEMPLATE + metric_tooltip, map_gdf).where(
+                    map_gdf['区間長_km'].notna(), render_template(TOOLTIP_TEMPLATE_NO_LENGTH + metric_tooltip, map_gdf)).to_numpy()
+            span.rows = len(colors)
+
+        # 広域表示では路線ごとのパス、拡大時は現在のズームに合った簡略化済みパスのうち表示範囲（と余白）にあるものだけに、
+        # 色とツールチップを付けて送る。地図をドラッグで動かしてもアプリには伝わらないので、余白は大きめにとっている
+        with tracer.span('レイヤデータ') as span:
+            path_index = route_paths if route_view else path_levels[pick_tolerance(view_state.zoom)]
+            paths = path_index.query(view_bounds(view_state.latitude, view_state.longitude, view_state.zoom))
+            path_rows = paths['row'].to_numpy()
+            layer_df = pd.DataFrame({'path': paths['path'], 'color': colors[path_rows].tolist(), 'tooltip': tooltips[path_rows]})
+            span.rows = len(layer_df)
         
         with map_container:
-            st.pydeck_chart(pdk.Deck(
-                map_style="road",
-                initial_view_state=st.session_state.view_state,
-                layers=[
-                    pdk.Layer("GeoJsonLayer", data=map_gdf, get_line_color='color',
-                              get_line_width=45, line_width_min_pixels=6,
-                              pickable=True, auto_highlight=True),
-                ],
-                tooltip={"html": "{tooltip}"}
-            ))
-            legend_html = create_legend_image(max_density)
-            st.markdown(legend_html, unsafe_allow_html=True)
+            # pydeck の JSON への変換と送信
+            with tracer.span('地図の描画') as span:
+                st.pydeck_chart(pdk.Deck(
+                    map_style="road",
+                    initial_view_state=view_state,
+                    layers=[
+                        pdk.Layer("PathLayer", data=layer_df, get_path='path', get_color='color',
+                                  get_width=45, width_min_pixels=6,
+                                  pickable=True, auto_highlight=True),
+                    ],
+                    tooltip={"html": "{tooltip}"}
+                )); span.rows = len(layer_df)
+            if route_view:
+                st.caption("路線ごとにまとめた1kmあたり件数で色分けしています（区間ごとの色分けは、サイドバーで"
+                           "「広域表示では路線ごとにまとめる」を外すか、地名検索や表の行の選択で移動すると表示されます）")
+            if len(paths) < len(path_index):
+                st.caption(f"表示範囲の付近にある {len(paths)} / {len(path_index)} 本の線を表示しています"
+                           "（「地図表示をリセット」で全体を表示します）")
+            with tracer.span('凡例'):
+                st.markdown(legend_html(max_density, label=metric_label), unsafe_allow_html=True)
             
         st.subheader("区間別データ（クリックで地図移動）")
-        display_df = map_gdf[map_gdf['件数'] > 0].sort_values(by='件数_per_km', ascending=False)
-        display_df_view = display_df[['件数_per_km', '件数', '区間長_km', SHP_START_IC_COL, SHP_END_IC_COL]]
-        
-        st.dataframe(
-            display_df_view,
-            key="data_selector",
-            on_select="rerun",
-            selection_mode="single-row"
-        )
+        if color_metric != '1kmあたり件数':
+            st.caption(f"ホットスポット（路線平均から見て偶然とは言いにくい区間、q値 < 0.05）: {int(section_rates['ホットスポット'].sum())} 区間")
+        with tracer.span('表') as span:
+            display_df = map_gdf[map_gdf['件数'] > 0].sort_values(by=metric_col, ascending=False)
+            display_df_view = display_df[['件数_per_km', '件数', '区間長_km', SHP_START_IC_COL, SHP_END_IC_COL] + metric_table_cols]
+            
+            st.dataframe(
+                display_df_view,
+                key="data_selector",
+                on_select="rerun",
+                selection_mode="single-row"
+            ); span.rows = len(display_df_view)
 
         if "data_selector" in st.session_state and st.session_state.data_selector['selection']['rows']:
             selected_index = st.session_state.data_selector['selection']['rows'][0]
@@ -260,4 +313,8 @@ try:
         st.warning("地図データの読み込み、またはロードキルデータとの結合に失敗しました。")
 
 except Exception as e:
-    st.error(f"アプリケーションの実行中に予期せぬエラーが発生しました: {e}")
\ No newline at end of file
+    st.error(f"アプリケーションの実行中に予期せぬエラーが発生しました: {e}")
+
+if tracer.enabled:
+    with st.sidebar.expander(f"処理時間（合計 {tracer.total_ms():.0f} ms）"):
+        st.dataframe(tracer.frame(), hide_index=True)
\ No newline at end of file
@@ -0,0 +1,117 @@
+import streamlit as st
+import pandas as pd
+import pydeck as pdk
+import numpy as np
+from roadkill.config import YEARLY_SOURCES
+from roadkill.styling import density_colors, change_colors, render_template
+from roadkill.legend import legend_html
+from roadkill.geometry import build_path_levels, pick_tolerance
+from roadkill.pipeline import load_time_series
+from roadkill.store import source_fingerprint
+from roadkill.timeseries import SectionTimeSeries, MONTHS_PER_YEAR
+
+# --- アプリケーションの基本設定 ---
+st.set_page_config(layout="wide", page_title="ロードキルマップ（年度比較）")
+
+# --- 1. 設定項目 ---
+# 年度ごとの事故 CSV と IC 付き区間シェープファイルは roadkill/config.py の YEARLY_SOURCES で指定する
+FIRST_YEAR, LAST_YEAR = min(YEARLY_SOURCES), max(YEARLY_SOURCES)
+METRIC_DENSITY, METRIC_YOY = '12か月移動密度', '前年同期比（12か月合計）'
+NO_DATA_COLOR = [200, 200, 200, 40]
+YOY_COLOR_LIMIT = 100  # 前年比の色は ±100% で頭打ちにする
+
+# 地図設定
+INITIAL_VIEW_STATE = pdk.ViewState(latitude=38.5, longitude=140.0, zoom=5.5, pitch=0)
+
+TOOLTIP_TEMPLATE = ("<b>路線名:</b> {道路名}<br/>"
+                    "<b>区間:</b> {start_IC}〜{end_IC}<br/>"
+                    "<b>12か月件数:</b> {件数_12か月:.0f} 件<br/>"
+                    "<b>1kmあたり件数:</b> {件数_per_km:.2f} 件/km<br/>"
+                    "<b>前年同期比:</b> {前年比}")
+
+# --- 2. データ読み込み（キャッシュ） ---
+# 年度をまたいだ区間 × 月の件数表は roadkill.pipeline が作り、ディスクに保存される
+# 移動合計・密度・前年比は全区間・全期間の行列として一度だけ計算し、スライダーでは列を取り出すだけにする
+# 全セッションで共有し、入力ファイルが変わったとき（source_key）だけ読み直す（roadkill.store を参照）
+@st.cache_resource(max_entries=1)
+def load_data(source_key):
+    try:
+        frames = load_time_series(YEARLY_SOURCES)
+    except Exception as e:
+        st.error(f"データ読み込みエラー: {e}"); st.stop()
+    series = SectionTimeSeries.from_frames(frames['monthly'], frames['section_attrs'], FIRST_YEAR, LAST_YEAR - FIRST_YEAR + 1)
+    metrics = {'件数_12か月': series.rolling_sum(), '件数_per_km': series.rolling_density(), '前年比_pct': series.yoy_change()}
+    return frames['sections'], frames['section_attrs'], series.labels, metrics
+
+# 地図レイヤ用の簡略化済みパス（ズーム段階ごとに一度だけ作成）
+@st.cache_resource(max_entries=1)
+def build_layer_paths(_sections_gdf, source_key):
+    return build_path_levels(_sections_gdf.geometry.values)
+
+# --- 3. メイン処理 ---
+st.title(f"ロードキルマップ（{FIRST_YEAR}〜{LAST_YEAR}年度の推移）")
+
+try:
+    source_key = source_fingerprint([path for year in sorted(YEARLY_SOURCES) for path in YEARLY_SOURCES[year]])
+    sections_gdf, section_attrs, period_labels, metrics = load_data(source_key)
+    path_levels = build_layer_paths(sections_gdf, source_key)
+
+    st.sidebar.header("表示設定")
+    metric = st.sidebar.radio("表示する指標", (METRIC_DENSITY, METRIC_YOY))
+    # 12 か月分（前年比はさらに 12 か月前の分も）がそろう月だけを選べるようにする
+    first_period = MONTHS_PER_YEAR - 1 + (MONTHS_PER_YEAR if metric == METRIC_YOY else 0)
+    if first_period >= len(period_labels):
+        st.warning("前年度のデータがないため、前年同期比は表示できません。YEARLY_SOURCES に年度を追加してください。"); st.stop()
+    period_options = period_labels[first_period:]
+    selected_label = st.sidebar.select_slider("対象月（この月までの12か月）", options=period_options, value=period_options[-1])
+    period = period_labels.index(selected_label)
+
+    # --- 選択した月の列を区間属性に付ける（区間 ID で直接参照） ---
+    section_df = section_attrs.copy()
+    for name, values in metrics.items():
+        section_df[name] = values[:, period]
+    section_df['前年比'] = pd.Series(np.char.mod('%+.1f%%', section_df['前年比_pct'].fillna(0).to_numpy()), dtype=object).where(
+        section_df['前年比_pct'].notna(), '―')
+
+    map_gdf = sections_gdf.copy(deep=False)  # 共有している load_data の戻り値には列を足さない
+    section_ids = map_gdf['section_id'].to_numpy()
+    for col in ['道路名', '件数_12か月', '件数_per_km', '前年比_pct', '前年比']:
+        map_gdf[col] = section_df[col].to_numpy()[section_ids]
+
+    if metric == METRIC_DENSITY:
+        max_value = map_gdf['件数_per_km'].max()
+        colors = density_colors(map_gdf['件数_per_km'], max_value, zero_color=NO_DATA_COLOR)
+        legend = legend_html(max_value)
+    else:
+        colors = change_colors(map_gdf['前年比_pct'], YOY_COLOR_LIMIT, nan_color=NO_DATA_COLOR)
+        legend = legend_html(YOY_COLOR_LIMIT, min_value=-YOY_COLOR_LIMIT, label='前年同期比（%）')
+    tooltips = render_template(TOOLTIP_TEMPLATE, map_gdf).to_numpy()
+
+    # 現在のズームに合った簡略化済みパスに、色とツールチップだけを付けて送る
+    paths = path_levels[pick_tolerance(INITIAL_VIEW_STATE.zoom)]
+    path_rows = paths['row'].to_numpy()
+    layer_df = pd.DataFrame({'path': paths['path'], 'color': colors[path_rows].tolist(), 'tooltip': tooltips[path_rows]})
+
+    st.pydeck_chart(pdk.Deck(
+        map_style="road",
+        initial_view_state=INITIAL_VIEW_STATE,
+        layers=[
+            pdk.Layer("PathLayer", data=layer_df, get_path='path', get_color='color',
+                      get_width=45, width_min_pixels=6,
+                      pickable=True, auto_highlight=True),
+        ],
+        tooltip={"html": "{tooltip}"}
+    ))
+    st.markdown(legend, unsafe_allow_html=True)
+
+    st.subheader("全区間の12か月合計の推移")
+    totals = np.nansum(metrics['件数_12か月'][:, MONTHS_PER_YEAR - 1:], axis=0)
+    st.line_chart(pd.Series(totals, index=period_labels[MONTHS_PER_YEAR - 1:], name='件数'))
+
+    st.subheader(f"区間別データ（{selected_label}まで）")
+    sort_col = '件数_per_km' if metric == METRIC_DENSITY else '前年比_pct'
+    display_df = section_df[section_df['件数_12か月'] > 0].sort_values(by=sort_col, ascending=False)
+    st.dataframe(display_df[['section_key', '道路名', '件数_12か月', '件数_per_km', '前年比', 'first_year', 'last_year']])
+
+except Exception as e:
+    st.error(f"アプリケーションの実行中に予期せぬエラーが発生しました: {e}")
\ No newline at end of file
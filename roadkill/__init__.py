@@ -0,0 +1 @@
+"""ロードキルマップ（app.py / roadkill-map.py）で共有する前処理・集計モジュール群。"""
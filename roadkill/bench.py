@@ -0,0 +1,188 @@
+"""処理段階ごとの所要時間を合成データで測るベンチマーク（Streamlit なしで動く）。
+
+    python -m roadkill.bench --rows 10000 100000 1000000 --output bench.json
+    python -m roadkill.bench --rows 100000 --output new.json --compare bench.json
+
+アプリの 1 回の描画にかかる処理を段階に分け、それぞれを roadkill の関数として直接呼んで測る。
+結果は JSON に保存し、--compare で別のコミットの結果と段階ごとに比べられる。
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from . import legend, pipeline, store
+from .config import (
+    CSV_ANIMAL_COL, CSV_LENGTH_COL, CSV_MONTH_COL, CSV_ROUTE_NAME_COL, CSV_SECTION_NAME_COL, FILTER_COLS, ROUTE_NAME_COL,
+)
+from .cube import CountCube
+from .filters import FilterEngine
+from .geometry import PathIndex, build_path_levels, build_route_paths, pick_tolerance, view_bounds
+from .styling import density_colors, density_per_km, render_template
+from .synthetic import ANIMALS, write_dataset
+
+# アプリで 1 か月・動物 3 種類を選んだ状態
+SELECTIONS = {CSV_MONTH_COL: [5], CSV_ANIMAL_COL: ANIMALS[:3]}
+TOOLTIP_TEMPLATE = ("<b>路線名:</b> {路線名}<br/><b>区間:</b> {区間}<br/>"
+                    "<b>1kmあたり件数:</b> {件数_per_km:.2f} 件/km<br/><b>合計件数:</b> {件数} 件<br/>"
+                    "<b>区間長:</b> {区間長_km:.1f} km")
+REGRESSION_RATIO = 1.2  # --compare でこれ以上遅くなった段階を目立たせる
+
+
+def _time(fn, repeat):
+    # 1 回目の結果を次の段階の入力に使い、repeat 回の最短・平均を返す
+    times, result = [], None
+    for i in range(repeat):
+        start = time.perf_counter()
+        value = fn()
+        times.append(time.perf_counter() - start)
+        if i == 0: result = value
+    return result, {'best': min(times), 'mean': sum(times) / len(times), 'repeat': repeat}
+
+
+def run_stages(paths, repeat=3, heavy_repeat=1):
+    """paths（synthetic.write_dataset の戻り値）のデータで各段階を測り、{段階名: 時間} を返す。
+
+    CSV の解析・IC 照合など 1 回が重い段階は heavy_repeat 回、描画ごとに走る段階は repeat 回測る。
+    """
+    csv_path, sections_shp_path = paths['csv_path'], paths['sections_shp_path']
+    timings = {}
+
+    def stage(name, fn, n=repeat):
+        result, timings[name] = _time(fn, n)
+        return result
+
+    # 読み込み（初回の解析と、保存済みキャッシュからの読み込み）
+    incidents = stage('load_csv', lambda: pipeline.read_incidents(csv_path), heavy_repeat)
+    pipeline.load_incidents(csv_path)
+    stage('load_cached', lambda: pipeline.load_incidents(csv_path))
+    section_index = stage('ic_section_index', lambda: pipeline.build_ic_section_index(
+        csv_path, paths['ic_shp_path'], paths['route_shp_path'])['section_index'], heavy_repeat)
+    map_sections = stage('map_sections', lambda: pipeline.build_map_sections(csv_path, sections_shp_path), heavy_repeat)
+
+    # app.py: フィルタ → (道路名, 区間) の集計 → 座標の結合 → 色・ツールチップ
+    filter_engine = stage('filter_build', lambda: FilterEngine(incidents, FILTER_COLS), heavy_repeat)
+    filtered = stage('filter_apply', lambda: filter_engine.apply(SELECTIONS))
+
+    def groupby_merge():
+        key_cols = [CSV_ROUTE_NAME_COL, CSV_SECTION_NAME_COL]
+        agg_funcs = {'件数': (CSV_SECTION_NAME_COL, 'size'), CSV_LENGTH_COL: (CSV_LENGTH_COL, 'first')}
+        counts = filtered.groupby(key_cols, observed=True).agg(**agg_funcs).reset_index()
+        return counts.merge(section_index, on=key_cols, how='inner').rename(columns={CSV_ROUTE_NAME_COL: '路線名'})
+    map_df = stage('groupby_merge', groupby_merge)
+
+    def styling():
+        density = density_per_km(map_df['件数'], map_df['区間長_km'])
+        styled = map_df.assign(件数_per_km=density)
+        colors = density_colors(density, density.max())
+        return colors, render_template(TOOLTIP_TEMPLATE, styled)
+    stage('styling', styling)
+
+    # roadkill-map.py: 件数キューブ → 区間別件数、地図レイヤのパス
+    cube = stage('cube_build', lambda: CountCube(
+        map_sections['counts'], 'section_id', FILTER_COLS, attr_cols=[CSV_LENGTH_COL, CSV_ROUTE_NAME_COL],
+        sections=pd.RangeIndex(len(map_sections['section_keys'])), weight_col='件数'), heavy_repeat)
+    stage('cube_counts', lambda: cube.counts(SELECTIONS))
+    path_levels = stage('layer_paths', lambda: build_path_levels(map_sections['sections'].geometry.values), heavy_repeat)
+    route_codes, _ = pd.factorize(map_sections['sections'][ROUTE_NAME_COL])
+    stage('route_paths', lambda: build_route_paths(map_sections['sections'].geometry.values, route_codes), heavy_repeat)
+
+    # 拡大時の表示範囲の絞り込み（最初の区間の中心をズーム 10 で表示）
+    path_index = stage('viewport_index', lambda: PathIndex(path_levels[pick_tolerance(10)]), heavy_repeat)
+    center = map_sections['sections'].geometry.iloc[0].centroid
+    stage('viewport_query', lambda: path_index.query(view_bounds(center.y, center.x, 10)))
+
+    # 凡例（キャッシュなしと、同じ最大値でのキャッシュあり）
+    max_density = float(np.nanmax(density_per_km(map_df['件数'], map_df['区間長_km']))) if len(map_df) else 1.0
+    def legend_cold():
+        legend._legend_html.cache_clear(); legend._gradient_stops.cache_clear()
+        return legend.legend_html(max_density)
+    stage('legend_cold', legend_cold)
+    stage('legend_warm', lambda: legend.legend_html(max_density))
+    return timings
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, current, threshold=REGRESSION_RATIO):
+    """2 つの結果（run_benchmark の戻り値）の、行数・段階ごとの best の比（current / baseline）を表にする。"""
+    rows = []
+    for run in current['runs']:
+        base_run = next((b for b in baseline['runs'] if b['rows'] == run['rows']), None)
+        if base_run is None: continue
+        for name, timing in run['stages'].items():
+            if name not in base_run['stages']: continue
+            before, after = base_run['stages'][name]['best'], timing['best']
+            rows.append({'rows': run['rows'], 'stage': name, 'baseline_s': before, 'current_s': after,
+                         'ratio': after / before if before > 0 else float('nan')})
+    table = pd.DataFrame(rows, columns=['rows', 'stage', 'baseline_s', 'current_s', 'ratio'])
+    table['regression'] = table['ratio'] >= threshold
+    return table
+
+
+def run_benchmark(row_counts, n_routes=50, ics_per_route=30, repeat=3, workdir=None, seed=0):
+    """行数ごとに合成データを作って run_stages を測り、JSON にできる dict を返す。"""
+    result = {
+        'commit': _git_commit(),
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'pandas': pd.__version__,
+        'params': {'routes': n_routes, 'ics_per_route': ics_per_route, 'repeat': repeat, 'seed': seed},
+        'runs': [],
+    }
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp_dir:
+        cache_dir, store.CACHE_DIR = store.CACHE_DIR, os.path.join(tmp_dir, 'cache')
+        try:
+            for n_rows in row_counts:
+                paths = write_dataset(os.path.join(tmp_dir, f'data_{n_rows}'), n_rows, n_routes, ics_per_route, seed)
+                result['runs'].append({'rows': n_rows, 'sections': n_routes * (ics_per_route - 1),
+                                       'stages': run_stages(paths, repeat)})
+        finally:
+            store.CACHE_DIR = cache_dir
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="合成データで処理段階ごとの所要時間を測る")
+    parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000], help="事故 CSV の行数（複数可）")
+    parser.add_argument('--routes', type=int, default=50, help="路線数")
+    parser.add_argument('--ics-per-route', type=int, default=30, help="路線あたりの IC 数")
+    parser.add_argument('--repeat', type=int, default=3, help="軽い段階の繰り返し回数")
+    parser.add_argument('--workdir', default=None, help="合成データを置く一時ディレクトリの親")
+    parser.add_argument('--output', default=None, help="結果の JSON の保存先")
+    parser.add_argument('--compare', default=None, help="比べる以前の結果の JSON")
+    args = parser.parse_args(argv)
+
+    result = run_benchmark(args.rows, args.routes, args.ics_per_route, args.repeat, args.workdir)
+    for run in result['runs']:
+        print(f"--- {run['rows']:,} 行 / {run['sections']:,} 区間")
+        for name, timing in run['stages'].items():
+            print(f"{name:18s} {timing['best'] * 1000:10.2f} ms")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            table = compare(json.load(f), result)
+        print(table.to_string(index=False))
+        if table['regression'].any(): return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,25 @@
+"""入力ファイルと列名の既定値（アプリ・パイプライン・CLI で共有）。"""
+
+# 入力ファイル
+CSV_PATH = '上下区別なし_R5.4～R6.3路上障害物（ロードキル）.csv'
+ROUTE_SHP_PATH = 'N06-23_HighwaySection.shp'
+IC_SHP_PATH = 'N06-23_Joint.shp'
+SECTIONS_SHP_PATH = 'final_highway_sections_with_ic.shp'
+MUNICIPALITIES_PATH = 'municipalities.csv'  # 任意（名称・緯度・経度の列を持つ市区町村一覧）
+# 年度ごとの入力（年度: (事故 CSV, IC 付き区間シェープファイル)）。時系列表示の年度はここに足す
+YEARLY_SOURCES = {2023: (CSV_PATH, SECTIONS_SHP_PATH)}
+
+# CSVの列名
+CSV_OFFICIAL_NAME_COL = '正式名称'
+CSV_ROUTE_NAME_COL, CSV_SECTION_NAME_COL, CSV_DIRECTION_COL = '道路名', '区間', '上下'
+CSV_WEATHER_COL, CSV_ANIMAL_COL = '排除時天候', '小分類'
+CSV_MONTH_COL, CSV_HOUR_COL, CSV_DAY_OF_WEEK_COL = '月', '時', '曜'
+CSV_LENGTH_COL = '区間長_km'
+FILTER_COLS = [CSV_MONTH_COL, CSV_HOUR_COL, CSV_DAY_OF_WEEK_COL, CSV_WEATHER_COL, CSV_ANIMAL_COL]
+
+# シェープファイルの列名
+IC_NAME_COL, ROUTE_NAME_COL = 'N06_018', 'N06_007'
+SHP_START_IC_COL, SHP_END_IC_COL = 'start_IC', 'end_IC'
+
+# IC を路線上とみなす距離
+DISTANCE_THRESHOLD_M = 3000
@@ -0,0 +1,113 @@
+"""区間 × フィルタ各次元の件数キューブ。"""
+import numpy as np
+import pandas as pd
+
+
+class CountCube:
+    """(区間, 月, 時, 曜, 天候, 動物) ごとの件数を疎な形（COO）で保持する。
+
+    行数ではなく非ゼロのセル数に比例する計算量で、任意のフィルタ条件の区間別件数を返す。
+    selections の形式は FilterEngine と同じ（{列名: 値 または 値のリスト}、None・空は絞り込みなし）。
+    欠損値は選択できない専用のコードに入れるため、その列を絞り込んだときだけ除外される。
+    sections を渡すと区間の並びをそれに固定し、含まれない区間の行は集計しない。
+    weight_col を渡すと 1 行を 1 件ではなくその列の値の件数として数える（count_cells の結果から作るとき）。
+    """
+
+    def __init__(self, df, section_col, dims, attr_cols=(), sections=None, weight_col=None):
+        self.section_col = section_col
+        self.dims = list(dims)
+        if sections is None:
+            section_codes, sections = pd.factorize(df[section_col], sort=True)
+        else:
+            section_codes = pd.Index(sections).get_indexer(df[section_col])
+        self.sections = pd.Index(sections, name=section_col)
+
+        codes, shape = [section_codes], [len(sections)]
+        self.categories = {}
+        for col in self.dims:
+            dim_codes, uniques = pd.factorize(df[col], sort=True)
+            dim_codes = np.where(dim_codes < 0, len(uniques), dim_codes)
+            self.categories[col] = {value: i for i, value in enumerate(uniques)}
+            codes.append(dim_codes)
+            shape.append(len(uniques) + 1)
+        valid = section_codes >= 0
+        keys = np.ravel_multi_index([c[valid] for c in codes], shape)
+        if weight_col is None:
+            cells, counts = np.unique(keys, return_counts=True)
+        else:
+            cells, inverse = np.unique(keys, return_inverse=True)
+            counts = np.bincount(inverse, weights=df[weight_col].to_numpy()[valid])
+        coords = np.unravel_index(cells, shape)
+        self.cell_section = coords[0].astype(np.int32)
+        self.cell_dims = {col: c.astype(np.int16) for col, c in zip(self.dims, coords[1:])}
+        self.cell_counts = counts.astype(np.int64)
+        self.shape = tuple(shape)
+
+        # 区間ごとの属性（区間長など）は全行での最初の値を使う
+        first_rows = df.loc[valid].groupby(section_codes[valid], sort=True)[list(attr_cols)].first()
+        self.section_attrs = first_rows.reindex(range(len(self.sections))).set_axis(self.sections)
+
+    def options(self, col):
+        """列の選択肢（欠損値を除いた値を並べ替えた順）。行数によらず、値の種類の数だけの時間で済む。"""
+        return list(self.categories[col])
+
+    def counts(self, selections):
+        """区間ごとの件数配列（self.sections と同じ並び）を返す。"""
+        keep = None
+        for col, selected in selections.items():
+            if selected is None: continue
+            values = selected if isinstance(selected, (list, tuple, set)) else [selected]
+            if not values: continue
+            allowed = np.zeros(self.shape[1 + self.dims.index(col)], dtype=bool)
+            for value in values:
+                code = self.categories[col].get(value)
+                if code is not None: allowed[code] = True
+            dim_keep = allowed[self.cell_dims[col]]
+            keep = dim_keep if keep is None else keep & dim_keep
+        sections, weights = (self.cell_section, self.cell_counts) if keep is None else (self.cell_section[keep], self.cell_counts[keep])
+        return np.bincount(sections, weights=weights, minlength=len(self.sections)).astype(np.int64)
+
+    def section_counts(self, selections, count_col='件数'):
+        """件数が 1 以上の区間だけを、属性列付きの DataFrame で返す（groupby の結果と同じ形）。"""
+        counts = self.counts(selections)
+        hit = counts > 0
+        result = self.section_attrs.loc[hit].copy()
+        result.insert(0, count_col, counts[hit])
+        return result.reset_index()
+
+
+def count_cells(df, section_col, dims, attr_cols=(), count_col='件数'):
+    """(区間, 各次元) の組ごとの件数表。区間ごとの属性列も付ける（CountCube を weight_col で作り直せる形）。"""
+    cells = df.groupby([section_col] + list(dims), dropna=False, sort=True, observed=True).size().rename(count_col).reset_index()
+    if attr_cols:
+        cells = cells.join(df.groupby(section_col)[list(attr_cols)].first(), on=section_col)
+    return cells
+
+
+def merge_cells(frames, section_col, dims, attr_cols=(), count_col='件数'):
+    """count_cells の結果をいくつか足し合わせる（元の行をまとめて count_cells したのと同じ表になる）。
+
+    区間ごとの属性は、先に渡した表に出てくる値を使う。
+    """
+    cells = pd.concat(frames, ignore_index=True)
+    merged = cells.groupby([section_col] + list(dims), dropna=False, sort=True, observed=True)[count_col].sum().reset_index()
+    if attr_cols:
+        merged = merged.join(cells.groupby(section_col)[list(attr_cols)].first(), on=section_col)
+    return merged
+
+
+def groupby_section_counts(filtered_df, section_col, attr_cols, count_col='件数'):
+    """キューブを使わない従来の集計（検証用）。"""
+    agg_funcs = {count_col: (section_col, 'size')}
+    agg_funcs.update({col: (col, 'first') for col in attr_cols})
+    return filtered_df.groupby(section_col).agg(**agg_funcs).reset_index()
+
+
+def check_consistency(cube, filtered_df, selections, count_col='件数'):
+    """キューブの区間別件数が、フィルタ済みの行を groupby した結果と一致するか確かめる。"""
+    expected = groupby_section_counts(filtered_df, cube.section_col, [], count_col).set_index(cube.section_col)[count_col]
+    expected = expected[expected.index.isin(cube.sections)]
+    actual = cube.section_counts(selections, count_col).set_index(cube.section_col)[count_col]
+    if not expected.sort_index().equals(actual.sort_index()):
+        diff = expected.sub(actual, fill_value=0)
+        raise ValueError(f"件数キューブと groupby の結果が一致しません: {int((diff != 0).sum())} 区間")
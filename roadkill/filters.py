@@ -0,0 +1,47 @@
+"""サイドバーのフィルタを、列ごとに前計算したビットセットの AND で処理するエンジン。"""
+import numpy as np
+import pandas as pd
+
+
+class FilterEngine:
+    """読み込み時に各フィルタ列をカテゴリコード化し、値ごとのビットセット（packbits）を持っておく。
+
+    selections は {列名: 値 または 値のリスト}。None・空リストの列は絞り込まない。
+    リスト内の値は OR、列どうしは AND で結合する。
+    """
+
+    def __init__(self, df, columns):
+        self.df = df
+        self.n_rows = len(df)
+        self.categories = {}
+        self.bitsets = {}
+        for col in columns:
+            codes, uniques = pd.factorize(df[col], sort=True)
+            self.categories[col] = list(uniques)
+            self.bitsets[col] = {value: np.packbits(codes == code) for code, value in enumerate(uniques)}
+        self._empty = np.zeros((self.n_rows + 7) // 8, dtype=np.uint8)
+
+    def options(self, col):
+        """列の選択肢（欠損値を除いた値を並べ替えた順）。読み込み時に求めた一覧の複製を返す。"""
+        return list(self.categories[col])
+
+    def mask(self, selections):
+        """条件に一致する行の bool 配列を返す（条件がなければ None）。"""
+        bits = None
+        for col, selected in selections.items():
+            if selected is None: continue
+            values = selected if isinstance(selected, (list, tuple, set)) else [selected]
+            if not values: continue
+            col_bits = self._empty.copy()
+            for value in values:
+                value_bits = self.bitsets[col].get(value)
+                if value_bits is not None: np.bitwise_or(col_bits, value_bits, out=col_bits)
+            bits = col_bits if bits is None else np.bitwise_and(bits, col_bits, out=bits)
+        if bits is None: return None
+        return np.unpackbits(bits, count=self.n_rows).view(bool)
+
+    def apply(self, selections):
+        """条件に一致する行だけを一度の take で取り出す（条件がなければ元のフレームをそのまま返す）。"""
+        mask = self.mask(selections)
+        if mask is None: return self.df
+        return self.df.take(np.flatnonzero(mask))
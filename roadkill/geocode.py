@@ -0,0 +1,279 @@
+"""地名検索（ジオコーディング）。
+
+同梱データ（IC・JCT の位置、区間の端点、任意の市区町村一覧）から作った地名索引をオフラインで引く
+OfflineGeocoder が基本で、完全一致・前方一致で見つからないときだけ Nominatim に問い合わせる（結果はディスクに保存し、
+同じ地名では二度とネットワークに出ない）。索引のあいまい一致は Nominatim が使えないか失敗したときの最後の手段
+（「横浜市」で「新横浜」を返すように、Nominatim なら正しく引ける地名まで近い名前の IC に取られてしまうため）。
+どれも geocode(query) が Location か None を返す。
+"""
+import abc
+import copy
+import json
+import logging
+import os
+import threading
+import uuid
+from collections import namedtuple
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+from . import store
+from .config import IC_NAME_COL, IC_SHP_PATH, MUNICIPALITIES_PATH, SECTIONS_SHP_PATH, SHP_END_IC_COL, SHP_START_IC_COL
+from .normalize import normalize_name, normalize_names, normalize_section_name, normalize_section_names
+
+logger = logging.getLogger(__name__)
+
+GAZETTEER_VERSION = 1
+# 同じ名前の地点で、これより近いもの（度）は 1 件にまとめる（IC と区間端点の重複など）
+DEDUP_DECIMALS = 2
+# あいまい検索で候補にする bigram の一致度（Dice 係数）の下限
+FUZZY_CUTOFF = 0.5
+# 同じ一致度なら IC・JCT、区間端点、市区町村の順に返す
+KIND_ORDER = {'ic': 0, 'section': 1, 'municipality': 2}
+NOMINATIM_ENABLED = os.environ.get('ROADKILL_NOMINATIM', '1') != '0'
+
+Location = namedtuple('Location', ['name', 'latitude', 'longitude', 'kind'])
+
+
+def normalize_key(name):
+    """索引・問い合わせ共通のキー（IC 名の正規化に加えて空白を除き、英字の大小を区別しない）。"""
+    return normalize_name(name).replace(' ', '').casefold()
+
+
+def normalize_keys(series):
+    """normalize_key のベクトル版。"""
+    return normalize_names(series).str.replace(' ', '', regex=False).str.casefold()
+
+
+def _sort_entries(entries):
+    # キー順、同じキーの中では KIND_ORDER 順
+    order = np.lexsort((entries['kind'].map(KIND_ORDER).to_numpy(), entries['key'].to_numpy(dtype=str)))
+    return entries.iloc[order].reset_index(drop=True)
+
+
+def _bigrams(key):
+    return {key[i:i + 2] for i in range(len(key) - 1)} if len(key) > 1 else {key}
+
+
+# --- 地名索引の作成 ---
+def _read_points(path):
+    # シェープファイルがなければ同じ名前の GeoJSON を読む
+    if not os.path.exists(path): path = os.path.splitext(path)[0] + '.geojson'
+    return gpd.read_file(path, encoding='utf-8').to_crs(epsg=4326)
+
+
+def _ic_entries(joint_path):
+    joints = _read_points(joint_path)
+    return pd.DataFrame({'name': joints[IC_NAME_COL], 'lat': joints.geometry.y, 'lon': joints.geometry.x, 'kind': 'ic'})
+
+
+def _section_entries(sections_path):
+    sections = gpd.read_file(sections_path, encoding='utf-8').to_crs(epsg=4326)
+    sections = sections[sections.geometry.notna()]
+    # 区間ごとに最初と最後の頂点を始点 IC・終点 IC の位置とする
+    coords, owner = shapely.get_coordinates(sections.geometry.values, return_index=True)
+    first = np.r_[0, np.flatnonzero(np.diff(owner)) + 1]
+    last = np.r_[first[1:] - 1, len(owner) - 1]
+    return pd.DataFrame({
+        'name': np.r_[sections[SHP_START_IC_COL].to_numpy(), sections[SHP_END_IC_COL].to_numpy()],
+        'lat': np.r_[coords[first, 1], coords[last, 1]],
+        'lon': np.r_[coords[first, 0], coords[last, 0]],
+        'kind': 'section',
+    })
+
+
+def _municipality_entries(municipalities_path):
+    # 1 列目が名称、2・3 列目が緯度・経度の CSV（列名は問わない）
+    table = pd.read_csv(municipalities_path)
+    return pd.DataFrame({'name': table.iloc[:, 0], 'lat': table.iloc[:, 1], 'lon': table.iloc[:, 2], 'kind': 'municipality'})
+
+
+def build_gazetteer(joint_path=IC_SHP_PATH, sections_path=SECTIONS_SHP_PATH, municipalities_path=MUNICIPALITIES_PATH):
+    """地名索引（name, key, lat, lon, kind の表、key 順）を作る。見つからない入力は飛ばす。"""
+    parts = []
+    for read, path in [(_ic_entries, joint_path), (_section_entries, sections_path), (_municipality_entries, municipalities_path)]:
+        if path and (os.path.exists(path) or os.path.exists(os.path.splitext(path)[0] + '.geojson')):
+            parts.append(read(path))
+    entries = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=['name', 'lat', 'lon', 'kind'])
+    entries = entries.dropna(subset=['name', 'lat', 'lon'])
+    entries['name'] = entries['name'].astype(str)
+    entries['key'] = normalize_keys(entries['name'])
+    entries = _sort_entries(entries[entries['key'] != ''].astype({'lat': float, 'lon': float}))
+    rounded = entries[['lat', 'lon']].round(DEDUP_DECIMALS)
+    entries = entries[~pd.concat([entries['key'], rounded], axis=1).duplicated()]
+    return {'gazetteer': entries[['name', 'key', 'lat', 'lon', 'kind']].reset_index(drop=True)}
+
+
+def _gazetteer_sources(*paths):
+    # キャッシュキーには実在する入力だけを使う（市区町村一覧は任意）
+    sources = []
+    for path in paths:
+        if not path: continue
+        if not os.path.exists(path): path = os.path.splitext(path)[0] + '.geojson'
+        if os.path.exists(path): sources.append(path)
+    return sources
+
+
+def load_gazetteer(joint_path=IC_SHP_PATH, sections_path=SECTIONS_SHP_PATH, municipalities_path=MUNICIPALITIES_PATH):
+    return store.load_cached('gazetteer', _gazetteer_sources(joint_path, sections_path, municipalities_path),
+                             lambda: build_gazetteer(joint_path, sections_path, municipalities_path),
+                             GAZETTEER_VERSION)['gazetteer']
+
+
+# --- ジオコーダ ---
+class Geocoder(abc.ABC):
+    """geocode(query) で Location（見つからなければ None）を返すものの共通の形。"""
+
+    @abc.abstractmethod
+    def geocode(self, query):
+        """query の地点を Location で返す。見つからなければ None。"""
+
+
+class OfflineGeocoder(Geocoder):
+    """地名索引を引く。完全一致 → 前方一致（短い名前から）→ bigram のあいまい一致の順に探す。
+
+    前方一致はキーの二分探索、あいまい一致は bigram の転置索引で候補を数えるだけなので、
+    索引が数千件でも 1 回の検索はミリ秒未満で終わる。fuzzy が偽ならあいまい一致はしない。
+    """
+
+    def __init__(self, gazetteer, fuzzy=True):
+        self.fuzzy = fuzzy
+        gazetteer = _sort_entries(gazetteer)
+        self.names = gazetteer['name'].to_numpy(dtype=object)
+        self.keys = gazetteer['key'].to_numpy(dtype=str)
+        self.lats, self.lons = gazetteer['lat'].to_numpy(), gazetteer['lon'].to_numpy()
+        self.kinds = gazetteer['kind'].to_numpy(dtype=object)
+        self.key_lengths = np.char.str_len(self.keys) if len(self.keys) else np.zeros(0, dtype=int)
+        # 「郡山JCT」のように接尾辞まで一致する名前は、同じキーの中で先に返す
+        self.full_names = normalize_section_names(gazetteer['name']).str.replace(' ', '', regex=False).str.casefold().to_numpy(dtype=object)
+
+        postings = {}
+        for i, key in enumerate(self.keys):
+            for bigram in _bigrams(key):
+                postings.setdefault(bigram, []).append(i)
+        self.bigram_counts = np.array([len(_bigrams(key)) for key in self.keys], dtype=np.int32)
+        self.postings = {bigram: np.array(ids, dtype=np.int32) for bigram, ids in postings.items()}
+
+    @classmethod
+    def from_files(cls, joint_path=IC_SHP_PATH, sections_path=SECTIONS_SHP_PATH, municipalities_path=MUNICIPALITIES_PATH):
+        return cls(load_gazetteer(joint_path, sections_path, municipalities_path))
+
+    def with_fuzzy(self, fuzzy):
+        """索引を共有したまま、あいまい一致の有無だけを変えたジオコーダ。"""
+        geocoder = copy.copy(self); geocoder.fuzzy = fuzzy
+        return geocoder
+
+    def _location(self, i):
+        return Location(self.names[i], float(self.lats[i]), float(self.lons[i]), self.kinds[i])
+
+    def _prefix_ids(self, key, full_name):
+        lo = np.searchsorted(self.keys, key, side='left')
+        hi = np.searchsorted(self.keys, key + '\U0010ffff', side='left')
+        ids = np.arange(lo, hi)
+        return ids[np.lexsort((self.key_lengths[ids], self.full_names[ids] != full_name))]
+
+    def _fuzzy_ids(self, key):
+        bigrams = _bigrams(key)
+        hits = [self.postings[bigram] for bigram in bigrams if bigram in self.postings]
+        if not hits: return np.zeros(0, dtype=np.int64)
+        shared = np.bincount(np.concatenate(hits), minlength=len(self.keys))
+        ids = np.flatnonzero(shared)
+        score = 2 * shared[ids] / (len(bigrams) + self.bigram_counts[ids])
+        keep = score >= FUZZY_CUTOFF
+        return ids[keep][np.argsort(-score[keep], kind='stable')]
+
+    def search(self, query, limit=5):
+        """query に合う地点を一致度の高い順に最大 limit 件返す。"""
+        key = normalize_key(query)
+        if not key or not len(self.keys): return []
+        ids = self._prefix_ids(key, normalize_section_name(query).replace(' ', '').casefold())
+        if len(ids) == 0 and self.fuzzy: ids = self._fuzzy_ids(key)
+        return [self._location(i) for i in ids[:limit]]
+
+    def geocode(self, query):
+        results = self.search(query, limit=1)
+        return results[0] if results else None
+
+
+class NominatimGeocoder(Geocoder):
+    """Nominatim への問い合わせ（タイムアウト付き）。結果は「見つからない」も含めて JSON ファイルに保存する。
+
+    通信エラーやタイムアウトは保存せずに例外のまま返すので、次の検索でもう一度問い合わせる。
+    st.cache_resource で全セッション（別々のスレッド）が 1 つを共有するので、保存済みの結果の読み書きはロックで守る
+    （問い合わせ自体はロックの外で行い、遅い検索が他のセッションを待たせないようにする）。
+    """
+
+    def __init__(self, user_agent='roadkill_mapper_app', timeout=3, country_codes='jp', cache_path=None):
+        from geopy.geocoders import Nominatim  # geopy はこのジオコーダを使うときだけ必要
+        self.client = Nominatim(user_agent=user_agent, timeout=timeout)
+        self.country_codes = country_codes
+        self.cache_path = cache_path or os.path.join(store.CACHE_DIR, 'geocode', 'nominatim.json')
+        try:
+            with open(self.cache_path, encoding='utf-8') as f:
+                self.cache = json.load(f)
+        except (OSError, ValueError):
+            self.cache = {}
+        self.lock = threading.Lock()
+
+    def _save(self):
+        # self.lock を持った状態で呼ぶ
+        tmp_path = f'{self.cache_path}.tmp-{uuid.uuid4().hex}'
+        try:
+            os.makedirs(os.path.dirname(self.cache_path) or '.', exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.cache, f, ensure_ascii=False)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            logger.warning("地名検索の結果を保存できませんでした: %s", e)
+            if os.path.exists(tmp_path): os.remove(tmp_path)
+
+    def geocode(self, query):
+        query = query.strip()
+        with self.lock:
+            found, cached = query in self.cache, self.cache.get(query)
+        if not found:
+            location = self.client.geocode(query, country_codes=self.country_codes)
+            cached = [location.address, location.latitude, location.longitude] if location else None
+            with self.lock:
+                self.cache[query] = cached; self._save()
+        return Location(cached[0], cached[1], cached[2], 'nominatim') if cached else None
+
+
+class ChainGeocoder(Geocoder):
+    """前のジオコーダで見つからなかったときだけ次を使う。
+
+    途中のジオコーダの例外（通信エラーなど）は記録して次に進み、最後まで見つからなければその例外を送出する。
+    """
+
+    def __init__(self, *geocoders):
+        self.geocoders = geocoders
+
+    def geocode(self, query):
+        error = None
+        for geocoder in self.geocoders:
+            try:
+                location = geocoder.geocode(query)
+            except Exception as e:
+                logger.warning("地名検索に失敗したため次の方法で探します（%s）: %s", type(geocoder).__name__, e)
+                error = error or e; continue
+            if location is not None: return location
+        if error is not None: raise error
+        return None
+
+
+def default_geocoder(joint_path=IC_SHP_PATH, sections_path=SECTIONS_SHP_PATH, municipalities_path=MUNICIPALITIES_PATH,
+                     use_nominatim=NOMINATIM_ENABLED):
+    """オフラインの地名索引（完全一致・前方一致）→ Nominatim → 地名索引のあいまい一致の順に探すジオコーダ。
+
+    ROADKILL_NOMINATIM=0（ネットワークのない環境など）や geopy がない場合はオフラインのみになる。
+    """
+    offline = OfflineGeocoder.from_files(joint_path, sections_path, municipalities_path)
+    if use_nominatim:
+        try:
+            return ChainGeocoder(offline.with_fuzzy(False), NominatimGeocoder(), offline)
+        except ImportError:
+            logger.info("geopy がないため Nominatim は使いません")
+    return ChainGeocoder(offline)
@@ -0,0 +1,94 @@
+"""地図レイヤに送る区間ジオメトリの前処理（簡略化・座標の平坦化）と、表示範囲での絞り込み。"""
+import numpy as np
+import pandas as pd
+import shapely
+from shapely import STRtree
+
+# ズームの上限ごとの簡略化の許容誤差（度）。0 は元の形状のまま
+# ブラウザでの拡大はアプリに伝わらないので、広域表示でも区間の形が崩れない約 20 m を最も粗い段階にする
+# （0.01°・0.002° では区間の 7 割が IC 間の直線になる）
+DEFAULT_TOLERANCE = 0.0002
+LOD_TOLERANCES = ((14.0, DEFAULT_TOLERANCE), (float('inf'), 0.0))
+ROUTE_TOLERANCE = 0.01  # 路線ごとにまとめた広域表示用のパスの許容誤差（度）
+COORD_DECIMALS = 5  # 約 1 m
+BOUNDS_COLS = ['minx', 'miny', 'maxx', 'maxy']
+
+# 表示範囲の見積もりに使う地図の大きさ（ピクセル）。ブラウザでの実際の大きさは分からないので大きめにとる
+VIEWPORT_PX = (1920, 1080)
+VIEWPORT_MARGIN = 1.0  # 表示範囲の幅・高さに対する、上下左右それぞれの余白の割合
+WORLD_PX = 512  # deck.gl のズーム 0 での世界の幅（ピクセル）
+
+
+def pick_tolerance(zoom, levels=LOD_TOLERANCES):
+    """ズームレベルに応じた許容誤差を返す。"""
+    for max_zoom, tolerance in levels:
+        if zoom < max_zoom: return tolerance
+    return levels[-1][1]
+
+
+def _to_paths(geometries, decimals):
+    # ジオメトリを構成線ごとの座標リストにする。row は元のジオメトリの位置、BOUNDS_COLS は構成線の外接矩形
+    parts, rows = shapely.get_parts(geometries, return_index=True)
+    non_empty = ~shapely.is_empty(parts)
+    parts, rows = parts[non_empty], rows[non_empty]
+    coords = np.round(shapely.get_coordinates(parts), decimals)
+    splits = np.cumsum(shapely.get_num_coordinates(parts))[:-1]
+    paths = pd.DataFrame({'path': [c.tolist() for c in np.split(coords, splits)], 'row': rows})
+    paths[BOUNDS_COLS] = shapely.bounds(parts).reshape(-1, 4)
+    return paths
+
+
+def build_path_levels(geometries, levels=LOD_TOLERANCES, decimals=COORD_DECIMALS):
+    """区間ジオメトリを許容誤差ごとに Douglas-Peucker で簡略化し、PathLayer 用の座標リストにする。
+
+    MultiLineString は構成線ごとに 1 本のパスに分ける。
+    戻り値は {許容誤差: DataFrame(path=座標リスト, row=元の区間の位置, minx・miny・maxx・maxy=外接矩形)}。
+    """
+    geometries = np.asarray(geometries)
+    path_levels = {}
+    for _, tolerance in levels:
+        simplified = shapely.simplify(geometries, tolerance, preserve_topology=False) if tolerance > 0 else geometries
+        path_levels[tolerance] = _to_paths(simplified, decimals)
+    return path_levels
+
+
+def build_route_paths(geometries, route_codes, tolerance=ROUTE_TOLERANCE, decimals=COORD_DECIMALS):
+    """区間ジオメトリを路線ごとにつないで簡略化した、広域表示用のパス。
+
+    route_codes は区間ごとの路線の番号（0 から、負は路線不明で除く）。つないだ線が途切れる路線は複数のパスになる。
+    戻り値は build_path_levels の 1 段階と同じ形の DataFrame（row は路線の番号）。
+    """
+    geometries, route_codes = np.asarray(geometries), np.asarray(route_codes)
+    merged = np.array([shapely.line_merge(shapely.union_all(geometries[route_codes == code]))
+                       for code in range(route_codes.max(initial=-1) + 1)], dtype=object)
+    return _to_paths(shapely.simplify(merged, tolerance, preserve_topology=False), decimals)
+
+
+def view_bounds(latitude, longitude, zoom, size_px=VIEWPORT_PX, margin=VIEWPORT_MARGIN):
+    """ビューの中心とズームから、余白を含めた表示範囲の経緯度 (minx, miny, maxx, maxy) を見積もる。"""
+    world_px = WORLD_PX * 2 ** zoom
+    half_width, half_height = (0.5 + margin) * size_px[0], (0.5 + margin) * size_px[1]
+    # 縦は Web メルカトルの y で広げてから緯度に戻す
+    y = np.log(np.tan(np.pi / 4 + np.radians(latitude) / 2))
+    dy = 2 * np.pi * half_height / world_px
+    south, north = np.degrees(2 * np.arctan(np.exp([y - dy, y + dy])) - np.pi / 2)
+    dx = 360 * half_width / world_px
+    return longitude - dx, float(south), longitude + dx, float(north)
+
+
+class PathIndex:
+    """パス（build_path_levels の 1 段階、build_route_paths の戻り値）の外接矩形の STRtree。
+
+    表示範囲と外接矩形が交わるパスだけを選ぶ。問い合わせは交わる矩形の数に比例する時間で済む。
+    """
+
+    def __init__(self, paths):
+        self.paths = paths
+        self.tree = STRtree(shapely.box(*paths[BOUNDS_COLS].to_numpy().T))
+
+    def __len__(self):
+        return len(self.paths)
+
+    def query(self, bounds):
+        """bounds（経緯度の minx, miny, maxx, maxy）と交わるパスを、元の並びのまま返す。"""
+        return self.paths.iloc[np.sort(self.tree.query(shapely.box(*bounds)))]
@@ -0,0 +1,142 @@
+"""区間の事故率の推定とホットスポットの判定。
+
+件数 / 区間長 のままだと、短い区間に 1〜2 件あるだけで率が極端に大きくなる。ここでは路線ごとの平均率を
+事前分布の平均とするポアソン・ガンマの経験ベイズ推定（Marshall 1991 のモーメント法）で率を縮小し、
+路線の平均率から期待される件数に対するポアソン上側確率で、偶然とは言いにくい区間を選ぶ。
+路線に沿った 1 次元のカーネル密度も求められる（区間内の件数は一様に分布するとみなす）。
+どれも全区間をまとめて配列で計算する。
+"""
+import numpy as np
+import pandas as pd
+
+KDE_BANDWIDTH_KM = 5.0
+SIGNIFICANCE_LEVEL = 0.05
+MIN_ROUTE_SECTIONS = 3  # 区間がこれより少ない路線は全体の平均率を基準にする
+EXACT_MAX_COUNT = 100  # poisson_sf で項を足して正確に求める件数の上限（これ以上は近似）
+
+
+def _normal_cdf(x):
+    # 標準正規分布の累積分布関数（Abramowitz & Stegun 7.1.26、誤差 1.5e-7 以下）
+    z = np.abs(x) / np.sqrt(2)
+    t = 1 / (1 + 0.3275911 * z)
+    poly = t * (0.254829592 + t * (-0.284496736 + t * (1.421413741 + t * (-1.453152027 + t * 1.061405429))))
+    erf = 1 - poly * np.exp(-z * z)
+    return 0.5 * (1 + np.sign(x) * erf)
+
+
+def poisson_sf(counts, expected):
+    """P(X >= counts)（X は平均 expected のポアソン分布）。
+
+    件数が EXACT_MAX_COUNT 未満の区間は項を足して正確に求める。それ以上の区間は
+    P(X >= k) = P(χ²(2k) <= 2·expected) を Wilson–Hilferty 近似で求める
+    （項の和は exp(-expected) が 745 を超える期待件数でアンダーフローし、件数に比例する回数の繰り返しもかかるため）。
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    expected = np.asarray(expected, dtype=float)
+    exact = counts < EXACT_MAX_COUNT
+    term = np.exp(-expected)
+    below = np.zeros_like(expected)
+    for k in range(int(counts[exact].max(initial=0))):
+        below += np.where(k < counts, term, 0)
+        term = term * expected / (k + 1)
+    dof = 2 * np.maximum(counts, 1)
+    z = (np.cbrt(2 * expected / dof) - (1 - 2 / (9 * dof))) / np.sqrt(2 / (9 * dof))
+    return np.where(exact, np.clip(1 - below, 0, 1), _normal_cdf(z))
+
+
+def benjamini_hochberg(p_values):
+    """Benjamini-Hochberg の q 値（多数の区間を同時に検定するための補正）。"""
+    p_values = np.asarray(p_values, dtype=float)
+    order = np.argsort(p_values)
+    ranked = p_values[order] * len(p_values) / np.arange(1, len(p_values) + 1)
+    q_values = np.empty_like(p_values)
+    q_values[order] = np.minimum.accumulate(ranked[::-1])[::-1].clip(max=1)
+    return q_values
+
+
+class HotspotEngine:
+    """区間の区間長・路線と、地図の行（区間ジオメトリ）の路線沿いの位置を持ち、件数の配列から率・密度を求める。
+
+    section_lengths・section_routes は区間 ID 順。row_sections は地図の行ごとの区間 ID、row_positions は
+    spatial.linear_reference の結果（地図の行と同じ並び）。カーネル密度を使わないなら省略できる。
+    """
+
+    def __init__(self, section_lengths, section_routes, row_sections=None, row_positions=None,
+                 bandwidth_km=KDE_BANDWIDTH_KM, min_route_sections=MIN_ROUTE_SECTIONS):
+        self.lengths = np.asarray(section_lengths, dtype=float)
+        route_codes, _ = pd.factorize(pd.Series(section_routes))
+        # 区間の少ない路線（と路線不明）は最後の 1 グループにまとめ、その基準は全区間の平均率にする（rank を参照）
+        sizes = np.bincount(route_codes[route_codes >= 0], minlength=route_codes.max(initial=-1) + 1)
+        small = (route_codes < 0) | (sizes[np.maximum(route_codes, 0)] < min_route_sections)
+        self.groups = np.where(small, len(sizes), route_codes)
+        self.n_groups = len(sizes) + 1
+        if row_positions is not None: self._prepare_kde(np.asarray(row_sections), row_positions, bandwidth_km)
+
+    def _group_sum(self, values):
+        return np.bincount(self.groups, weights=values, minlength=self.n_groups)
+
+    def rank(self, counts, alpha=SIGNIFICANCE_LEVEL):
+        """区間 ID 順の件数から、縮小推定した率とホットスポットの判定を区間 ID 順の DataFrame で返す。
+
+        区間長が 0 以下・欠損の区間は率を求めず（欠損）、判定からも外す。
+        """
+        counts = np.asarray(counts, dtype=float)
+        valid = self.lengths > 0
+        lengths = np.where(valid, self.lengths, 0)
+        counts_in = np.where(valid, counts, 0)
+
+        # 路線ごとの平均率 m、率の分散 s²、事前分布の分散 A = s² - m / 平均区間長（負なら 0）
+        total_length, total_count = self._group_sum(lengths), self._group_sum(counts_in)
+        n_valid = self._group_sum(valid.astype(float))
+        base = np.divide(total_count, total_length, out=np.zeros(self.n_groups), where=total_length > 0)
+        base[-1] = total_count.sum() / total_length.sum() if total_length.sum() > 0 else 0.0
+        raw = np.divide(counts_in, lengths, out=np.zeros_like(counts), where=valid)
+        spread = np.divide(self._group_sum(lengths * (raw - base[self.groups]) ** 2), total_length,
+                           out=np.zeros(self.n_groups), where=total_length > 0)
+        mean_length = np.divide(total_length, n_valid, out=np.ones(self.n_groups), where=n_valid > 0)
+        prior_var = np.maximum(spread - base / mean_length, 0)
+
+        m, a = base[self.groups], prior_var[self.groups]
+        weight = np.divide(a, a + np.divide(m, lengths, out=np.zeros_like(m), where=valid),
+                           out=np.zeros_like(m), where=a > 0)
+        shrunk = m + weight * (raw - m)
+        expected = m * lengths
+        p_values = np.where(valid, poisson_sf(counts_in, expected), 1.0)
+        q_values = benjamini_hochberg(p_values)
+        return pd.DataFrame({
+            '件数': counts.astype(np.int64),
+            '基準率': np.where(valid, m, np.nan),
+            '期待件数': np.where(valid, expected, np.nan),
+            '推定率': np.where(valid, shrunk, np.nan),
+            'p値': p_values,
+            'q値': q_values,
+            'ホットスポット': valid & (q_values < alpha) & (counts_in > expected),
+        })
+
+    def _prepare_kde(self, row_sections, row_positions, bandwidth_km):
+        line = row_positions['line'].to_numpy()
+        start, end = row_positions['start_km'].to_numpy(), row_positions['end_km'].to_numpy()
+        centers = (start + end) / 2
+        # 同じ区間 ID の行が複数あれば件数は長さで按分する
+        known = row_sections >= 0
+        span = np.maximum(end - start, 1e-3)
+        section_span = np.bincount(row_sections[known], weights=span[known], minlength=len(self.lengths))
+        self.row_sections = np.where(known, row_sections, 0)
+        self.row_share = np.where(known, span / np.maximum(section_span[self.row_sections], 1e-3), 0)
+
+        # 同じ線の上の行の組 (i, j) すべてについて、j の区間に一様に置いた件数の i の中点での寄与を前もって求める
+        order = np.argsort(line, kind='stable')
+        boundaries = np.flatnonzero(np.diff(line[order])) + 1
+        groups = np.split(order, boundaries)
+        pair_i = np.concatenate([np.repeat(group, len(group)) for group in groups]) if groups else np.zeros(0, dtype=np.int64)
+        pair_j = np.concatenate([np.tile(group, len(group)) for group in groups]) if groups else np.zeros(0, dtype=np.int64)
+        x = centers[pair_i]
+        mass = _normal_cdf((x - start[pair_j]) / bandwidth_km) - _normal_cdf((x - end[pair_j]) / bandwidth_km)
+        self.pair_i, self.pair_j = pair_i, pair_j
+        self.pair_weight = mass / span[pair_j]
+        self.n_rows = len(line)
+
+    def kernel_density(self, counts):
+        """区間 ID 順の件数から、地図の行ごとの路線沿いのカーネル密度（件/km、行の中点での値）を返す。"""
+        row_counts = np.asarray(counts, dtype=float)[self.row_sections] * self.row_share
+        return np.bincount(self.pair_i, weights=self.pair_weight * row_counts[self.pair_j], minlength=self.n_rows)
@@ -0,0 +1,154 @@
+"""月次 CSV を置いたディレクトリの差分取り込み。
+
+ファイルごとの処理結果を内容のハッシュ単位で保存しておき、新しいファイルだけを処理して追記する。
+集計表（区間別件数など）は保存済みの集計に新しい分を足し合わせるだけで更新するので、
+取り込みにかかる時間は新しい月のデータ量に比例し、過去の年数にはよらない。
+ファイルが消えたり中身が変わったりした場合は、その分を引けないので作り直す。
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import uuid
+
+from . import schema, store
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = 'manifest.json'
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """ファイル内容の SHA-1。"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def list_csv_files(csv_dir):
+    return sorted(os.path.join(csv_dir, file) for file in os.listdir(csv_dir) if file.lower().endswith('.csv'))
+
+
+class PartStore:
+    """処理結果をファイル（パーツ）単位で保存する差分取り込み用のストア。
+
+    name・source（取り込むディレクトリ）・key（処理の版など）ごとに store.CACHE_DIR/ingest/ の下に 1 つのディレクトリを持ち、
+    manifest.json に取り込み済みのパーツ（内容ハッシュ・ファイル名・行数）の順番と、集計表のファイル名を記録する。
+    manifest.json の置き換えが取り込みの確定で、それまでに中断しても前の状態のまま読める。
+    パーツ・集計表のファイルも置き換えで書くので、同じ月を同時に取り込む別のプロセスが書きかけのファイルを読むことはない。
+    """
+
+    def __init__(self, name, source, key):
+        self.prefix = store.source_id([source])
+        self.root = os.path.join(store.CACHE_DIR, 'ingest', name, f'{self.prefix}-{hashlib.sha1(key.encode()).hexdigest()[:16]}')
+        try:
+            with open(os.path.join(self.root, MANIFEST_FILE), encoding='utf-8') as f:
+                self.manifest = json.load(f)
+        except (OSError, ValueError):
+            self.manifest = {'parts': [], 'aggregates': {}, 'digests': {}}
+
+    @property
+    def parts(self):
+        return self.manifest['parts']
+
+    def digest(self, path):
+        """file_digest と同じ値。サイズ・更新時刻が前回と同じファイルは読み直さない。"""
+        stat = os.stat(path)
+        stamp = [stat.st_size, stat.st_mtime_ns]
+        cached = self.manifest['digests'].get(os.path.abspath(path))
+        if cached and cached[:2] == stamp: return cached[2]
+        digest = file_digest(path)
+        self.manifest['digests'][os.path.abspath(path)] = stamp + [digest]
+        return digest
+
+    def _part_path(self, digest, frame_name):
+        return os.path.join(self.root, 'parts', digest, f'{frame_name}.feather')
+
+    def sync(self, items, process, aggregates=None):
+        """items（(内容ハッシュ, 入力) の並び）のうち未処理のものだけを process(入力) で処理して追記する。
+
+        process は {名前: DataFrame} を返す関数。aggregates は {集計名: 関数} で、関数は
+        [保存済みの集計, 新しいパーツの同名の表, ...] を受け取り（初回は保存済みの集計なし）、足し合わせた表を返す。
+        戻り値は新しく取り込んだパーツの数。
+        """
+        items = list(items)
+        current = {digest for digest, _ in items}
+        if any(part['digest'] not in current for part in self.parts):
+            logger.info("取り込み済みのファイルがなくなったか変わったため、作り直します: %s", self.root)
+            self.reset()
+        done = {part['digest'] for part in self.parts}
+        new_parts, new_frames = [], []
+        for digest, source in items:
+            if digest in done: continue
+            frames = process(source)
+            os.makedirs(os.path.dirname(self._part_path(digest, '_')), exist_ok=True)
+            for frame_name, frame in frames.items():
+                store.write_frame(frame, self._part_path(digest, frame_name))
+            rows = len(next(iter(frames.values()))) if frames else 0
+            new_parts.append({'digest': digest, 'source': os.path.basename(str(source)), 'rows': rows})
+            new_frames.append(frames)
+            done.add(digest)
+
+        old_aggregates = dict(self.manifest['aggregates'])
+        if new_parts:
+            generation = uuid.uuid4().hex[:8]
+            for agg_name, merge in (aggregates or {}).items():
+                previous = [self.read_aggregate(agg_name)] if agg_name in old_aggregates else []
+                merged = merge(previous + [frames[agg_name] for frames in new_frames])
+                file = f'{agg_name}-{generation}.feather'
+                store.write_frame(merged.reset_index(drop=True), os.path.join(self.root, file))
+                self.manifest['aggregates'][agg_name] = file
+            self.manifest['parts'] = self.parts + new_parts
+        self._write_manifest()
+        if new_parts:
+            for agg_name, file in old_aggregates.items():
+                if self.manifest['aggregates'].get(agg_name) != file:
+                    os.remove(os.path.join(self.root, file))
+        # 同じ入力ディレクトリの古いキー（処理の版などが変わる前のもの）は消す（別のディレクトリのストアは残す）
+        parent = os.path.dirname(self.root)
+        for entry in os.listdir(parent):
+            if entry.startswith(f'{self.prefix}-') and entry != os.path.basename(self.root):
+                shutil.rmtree(os.path.join(parent, entry), ignore_errors=True)
+        return len(new_parts)
+
+    def _write_manifest(self):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = os.path.join(self.root, f'{MANIFEST_FILE}.tmp-{uuid.uuid4().hex}')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, ensure_ascii=False)
+        os.replace(tmp_path, os.path.join(self.root, MANIFEST_FILE))
+
+    def reset(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+        self.manifest = {'parts': [], 'aggregates': {}, 'digests': self.manifest['digests']}
+
+    def read_part(self, digest, frame_name):
+        return store.read_frame(self._part_path(digest, frame_name))
+
+    def read_parts(self, frame_name, offsets=None):
+        """全パーツの frame_name を取り込み順に連結する。
+
+        offsets（{内容ハッシュ: 先頭行の番号}）を渡すと、各パーツの行番号にそれを足した索引にする
+        （別のストアの行と索引で結合するため）。渡さなければ 0 からの連番。
+        """
+        frames = []
+        for part in self.parts:
+            frame = self.read_part(part['digest'], frame_name)
+            if offsets is not None: frame.index = frame.index + offsets[part['digest']]
+            frames.append(frame)
+        if not frames: return None
+        return schema.concat_frames(frames, ignore_index=offsets is None)
+
+    def row_offsets(self):
+        """パーツごとの先頭行の番号（read_parts で連結したときの位置）。"""
+        offsets, total = {}, 0
+        for part in self.parts:
+            offsets[part['digest']] = total
+            total += part['rows']
+        return offsets
+
+    def read_aggregate(self, agg_name):
+        return store.read_frame(os.path.join(self.root, self.manifest['aggregates'][agg_name]))
@@ -0,0 +1,50 @@
+"""カラーバー凡例（CSS グラデーションの HTML）。
+
+最大値を有効数字 3 桁に丸めた値とカラーマップ名をキーに LRU キャッシュするので、
+同じ凡例は文字列を返すだけになる。matplotlib はキャッシュにない色を取り出すときだけ使う。
+"""
+import math
+from functools import lru_cache
+
+LEGEND_LABEL = '1kmあたりの件数'
+GRADIENT_STOPS = 11
+
+
+@lru_cache(maxsize=8)
+def _gradient_stops(cmap_name, n_stops=GRADIENT_STOPS):
+    import matplotlib
+    import numpy as np
+    rgba = matplotlib.colormaps[cmap_name](np.linspace(0, 1, n_stops), bytes=True)
+    return ', '.join(f'rgb({r}, {g}, {b}) {i * 100 / (n_stops - 1):g}%' for i, (r, g, b, _) in enumerate(rgba))
+
+
+def _nice_ticks(min_value, max_value, target=5):
+    # min_value から max_value までを 1・2・2.5・5 × 10^n 刻みで target 個程度に分ける
+    raw_step = (max_value - min_value) / target
+    magnitude = 10 ** math.floor(math.log10(raw_step))
+    step = next(f * magnitude for f in (1, 2, 2.5, 5, 10) if f * magnitude >= raw_step)
+    first = math.ceil(min_value / step - 1e-9)
+    return [i * step for i in range(first, int(max_value / step + 1e-9) + 1)]
+
+
+@lru_cache(maxsize=128)
+def _legend_html(min_value, max_value, cmap_name, label):
+    span = max_value - min_value
+    ticks = ''.join(
+        f'<span style="position: absolute; left: {(tick - min_value) / span * 100:.2f}%; transform: translateX(-50%);">{round(tick, 10):g}</span>'
+        for tick in _nice_ticks(min_value, max_value))
+    return f'''
+    <div style="position: absolute; bottom: 50px; right: 20px; z-index: 1000;">
+        <div style="background-color: white; border-radius: 8px; padding: 8px 14px; border: 1px solid #ccc; font-size: 10px; text-align: center; box-shadow: 0 4px 8px rgba(0,0,0,0.1);">
+            <div style="width: 220px; height: 12px; border: 1px solid #555; background: linear-gradient(to right, {_gradient_stops(cmap_name)});"></div>
+            <div style="position: relative; width: 220px; height: 13px; font-size: 9px;">{ticks}</div>
+            <div style="font-size: 10px;">{label}</div>
+        </div>
+    </div>'''
+
+
+def legend_html(max_value, cmap_name='coolwarm', min_value=0.0, label=LEGEND_LABEL):
+    """min_value〜max_value のカラーバー凡例の HTML を返す（max_value が min_value 以下なら min_value〜min_value + 1）。"""
+    min_value = float(f'{min_value:.3g}')
+    max_value = float(f'{max_value:.3g}') if max_value > min_value else min_value + 1.0
+    return _legend_html(min_value, max_value, cmap_name, label)
@@ -0,0 +1,56 @@
+"""IC 名・路線名・区間名の表記ゆれの正規化。
+
+スカラー版（LRU キャッシュ付き）と、Series の重複を除いてから .str でまとめて処理するベクトル版がある。
+どちらも従来の実装と同じ結果を返す（tests/test_normalize.py で同梱データを使って確かめている）。
+"""
+from functools import lru_cache
+
+import pandas as pd
+
+# 全角英数記号 → 半角、全角スペース → 半角スペース
+_WIDTH_TABLE = str.maketrans({**{chr(0xFF01 + i): chr(0x21 + i) for i in range(94)}, '　': ' '})
+# 従来の実装と同じ順に 1 つずつ消す（消したあとに新しくできた接尾辞も次の段で消える。例: 「PICA」→「PA」→「」）
+# 全角の接尾辞は _WIDTH_TABLE で半角になっているので不要。IC を先に消すので「SIC」は「S」が残る
+_SUFFIXES = ('IC', 'JCT', 'SIC', 'SA', 'PA', 'TB')
+
+
+@lru_cache(maxsize=65536)
+def normalize_name(name, is_route=False):
+    if not isinstance(name, str): return ""
+    name = name.translate(_WIDTH_TABLE)
+    if is_route:
+        if name.endswith('道'): name = name.replace('道', '')
+        return name.strip()
+    for suffix in _SUFFIXES: name = name.replace(suffix, '')
+    return name.strip()
+
+
+@lru_cache(maxsize=65536)
+def normalize_section_name(name):
+    if not isinstance(name, str): return ""
+    return name.translate(_WIDTH_TABLE).strip()
+
+
+def _normalize_unique(series, transform):
+    # 重複を除いた値だけを変換して元の並びに戻す（欠損・文字列以外は ""）
+    codes, uniques = pd.factorize(series)
+    normalized = transform(pd.Series(uniques, dtype=object)).fillna('').tolist()
+    normalized.append('')  # codes == -1（欠損）は末尾の "" を指す
+    return pd.Series([normalized[code] for code in codes] if len(codes) else [], index=series.index)
+
+
+def normalize_names(series, is_route=False):
+    """normalize_name のベクトル版。"""
+    def transform(names):
+        names = names.str.translate(_WIDTH_TABLE)
+        if is_route:
+            names = names.where(~names.str.endswith('道', na=False), names.str.replace('道', '', regex=False))
+            return names.str.strip()
+        for suffix in _SUFFIXES: names = names.str.replace(suffix, '', regex=False)
+        return names.str.strip()
+    return _normalize_unique(series, transform)
+
+
+def normalize_section_names(series):
+    """normalize_section_name のベクトル版。"""
+    return _normalize_unique(series, lambda names: names.str.translate(_WIDTH_TABLE).str.strip())
@@ -0,0 +1,296 @@
+"""CSV・シェープファイルから地図用の中間データを作るパイプライン。
+
+Streamlit に依存しないので、重い前処理を夜間バッチなどで先に済ませておける:
+
+    python -m roadkill.pipeline --workers 8
+
+各段階の結果は roadkill.store のキャッシュに保存され、入力ファイルが同じならアプリはそれを読むだけになる。
+CSV_PATH に月次 CSV を置いたディレクトリを指定すると、新しいファイルの分だけを取り込んで
+事故データと区間別件数表に追記する（roadkill.ingest）。
+"""
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, product
+
+import geopandas as gpd
+import pandas as pd
+
+from . import ingest, schema, store
+from .config import (
+    CSV_PATH, ROUTE_SHP_PATH, IC_SHP_PATH, SECTIONS_SHP_PATH, MUNICIPALITIES_PATH,
+    CSV_OFFICIAL_NAME_COL, CSV_ROUTE_NAME_COL, CSV_SECTION_NAME_COL, CSV_MONTH_COL, CSV_LENGTH_COL, FILTER_COLS,
+    IC_NAME_COL, ROUTE_NAME_COL, SHP_START_IC_COL, SHP_END_IC_COL, DISTANCE_THRESHOLD_M, YEARLY_SOURCES,
+)
+from .cube import CountCube, check_consistency, count_cells, merge_cells
+from .geocode import load_gazetteer
+from .normalize import normalize_name, normalize_names, normalize_section_names
+from .sections import SECTION_SEP, build_section_keys, match_section_ids, merge_unmatched, unmatched_sections
+from .spatial import clip_between, find_route_ic_candidates
+from .timeseries import period_index
+
+# 前処理の内容を変えたら上げる（キャッシュを作り直させる）
+PIPELINE_VERSION = 5
+
+
+# --- 1. 事故 CSV ---
+def read_incidents(csv_path, chunk_rows=schema.CHUNK_ROWS):
+    """CSV を読み、両アプリ共通の条件で欠損・数値でない行を除く（アプリ固有の条件は読み込み側で絞る）。
+
+    chunk_rows 行ずつ読んで schema の型（カテゴリ・int8）にしてから連結するので、
+    文字列のままの全行を一度に持つことはない。索引は CSV のデータ行の番号。
+    """
+    chunks = []
+    for chunk in pd.read_csv(csv_path, encoding='utf-8-sig', header=2, dtype=schema.CSV_DTYPES, chunksize=chunk_rows):
+        chunk = schema.coerce_chunk(chunk)
+        chunk['section_norm'] = normalize_section_names(chunk[CSV_SECTION_NAME_COL]).astype('category')
+        chunks.append(chunk)
+    return schema.concat_frames(chunks)
+
+
+def sync_incidents(csv_dir):
+    """csv_dir の CSV のうち、まだ取り込んでいないものだけを読んで追記する。取り込み済みのストアを返す。"""
+    incident_store = ingest.PartStore('incidents', csv_dir, f'v{PIPELINE_VERSION}')
+    incident_store.sync([(incident_store.digest(path), path) for path in ingest.list_csv_files(csv_dir)],
+                        lambda path: {'incidents': read_incidents(path).reset_index(drop=True)})
+    if not incident_store.parts: raise FileNotFoundError(f"CSV がありません: {csv_dir}")
+    return incident_store
+
+
+def load_incidents(csv_path=CSV_PATH):
+    if os.path.isdir(csv_path):
+        if store.feather is None:  # 保存できないので毎回すべて読む
+            return schema.concat_frames([read_incidents(path) for path in ingest.list_csv_files(csv_path)], ignore_index=True)
+        return sync_incidents(csv_path).read_parts('incidents')
+    return store.load_cached('incidents', [csv_path], lambda: {'incidents': read_incidents(csv_path)},
+                             PIPELINE_VERSION)['incidents']
+
+
+# --- 2. (道路名, 区間) → 始点・終点 IC の座標（app.py 用） ---
+def match_route_names(csv_routes, shp_routes):
+    """CSV の道路名を、正規化した名前を含むシェープファイルの路線名に対応付ける。"""
+    route_name_map = {}
+    for csv_name in csv_routes:
+        norm_csv_name = normalize_name(csv_name, is_route=True)
+        for shp_name in shp_routes:
+            if norm_csv_name in shp_name: route_name_map[csv_name] = shp_name; break
+    return route_name_map
+
+
+def _resolve_route(task):
+    # 1 路線分の区間について、路線上の IC 候補から最も近い (始点, 終点) の組を選ぶ
+    from haversine import haversine  # IC 照合（app.py 用）でだけ必要なので、ここで読み込む
+    sections, route_ics = task
+    map_data = []
+    for position, csv_route_name, section, start_name, end_name in sections.itertuples(index=False, name=None):
+        valid_starts, valid_ends = route_ics.get(start_name, []), route_ics.get(end_name, [])
+        if not valid_starts or not valid_ends: continue
+        min_dist, best_pair = float('inf'), None
+        for start_point, end_point in product(valid_starts, valid_ends):
+            dist = haversine((start_point.y, start_point.x), (end_point.y, end_point.x))
+            if dist > 0 and dist < min_dist: min_dist, best_pair = dist, (start_point, end_point)
+        if best_pair:
+            map_data.append({'position': position, CSV_ROUTE_NAME_COL: csv_route_name, CSV_SECTION_NAME_COL: section,
+                             "start_lon": best_pair[0].x, "start_lat": best_pair[0].y,
+                             "end_lon": best_pair[1].x, "end_lat": best_pair[1].y})
+    return map_data
+
+
+def resolve_section_coords(sections, route_candidates, workers=1):
+    """(道路名, 区間) ごとに始点・終点の座標を求める。路線単位でプロセスプールに分けて処理する。"""
+    route_name_map = match_route_names(sections[CSV_ROUTE_NAME_COL].unique(), list(route_candidates))
+    sections = sections[['position', CSV_ROUTE_NAME_COL, CSV_SECTION_NAME_COL, '始点_norm', '終点_norm']]
+    official_routes = sections[CSV_ROUTE_NAME_COL].map(route_name_map)
+    tasks = [(group, route_candidates[route]) for route, group in sections.groupby(official_routes, sort=False, observed=True)]
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_resolve_route, tasks, chunksize=8))
+    else:
+        results = [_resolve_route(task) for task in tasks]
+    columns = ['position', CSV_ROUTE_NAME_COL, CSV_SECTION_NAME_COL, "start_lon", "start_lat", "end_lon", "end_lat"]
+    map_df = pd.DataFrame(list(chain.from_iterable(results)), columns=columns)
+    return map_df.sort_values('position').drop(columns='position').reset_index(drop=True)
+
+
+def build_ic_section_index(csv_path, ic_shp_path, route_shp_path, workers=1):
+    incidents = load_incidents(csv_path)
+    ic_gdf = gpd.read_file(ic_shp_path, encoding='utf-8').to_crs(epsg=4326)
+    route_gdf = gpd.read_file(route_shp_path, encoding='utf-8').to_crs(epsg=4326)
+    ic_gdf['ic_name_norm'] = normalize_names(ic_gdf[IC_NAME_COL])
+    route_gdf['route_name_norm'] = normalize_names(route_gdf[ROUTE_NAME_COL], is_route=True)
+    route_candidates = find_route_ic_candidates(ic_gdf, route_gdf, DISTANCE_THRESHOLD_M)
+
+    key_cols = [CSV_ROUTE_NAME_COL, CSV_SECTION_NAME_COL]
+    sections = incidents[key_cols].drop_duplicates().reset_index(drop=True)
+    sections['position'] = sections.index
+    split_sections = sections[CSV_SECTION_NAME_COL].str.split(SECTION_SEP, expand=True)
+    sections['始点_norm'] = normalize_names(split_sections[0])
+    sections['終点_norm'] = normalize_names(split_sections[1]) if 1 in split_sections.columns else ""
+    section_index, section_paths = clip_section_paths(resolve_section_coords(sections, route_candidates, workers), route_gdf)
+    return {'section_index': section_index, 'section_paths': section_paths}
+
+
+def clip_section_paths(section_index, route_gdf):
+    """IC 座標を解決した区間ごとに、路線の線を始点・終点 IC の間で切り出す。
+
+    同じ (路線, 始点 IC, 終点 IC) の区間は 1 本の線を共有する。戻り値は section_index に線の番号（path_id）を
+    足したものと、path_id 順の線の GeoDataFrame（EPSG:4326）。
+    """
+    coord_cols = ["start_lon", "start_lat", "end_lon", "end_lat"]
+    route_name_map = match_route_names(section_index[CSV_ROUTE_NAME_COL].unique(), sorted(route_gdf['route_name_norm'].dropna().unique()))
+    keys = section_index[coord_cols].assign(route=section_index[CSV_ROUTE_NAME_COL].map(route_name_map))
+    path_ids = keys.groupby(['route'] + coord_cols, sort=False).ngroup().to_numpy()
+    pairs = keys.drop_duplicates().reset_index(drop=True)  # 最初に現れた順（path_id の順）
+    geometry = clip_between(route_gdf.geometry, route_gdf['route_name_norm'], pairs['route'],
+                            gpd.GeoSeries(gpd.points_from_xy(pairs['start_lon'], pairs['start_lat']), crs=route_gdf.crs),
+                            gpd.GeoSeries(gpd.points_from_xy(pairs['end_lon'], pairs['end_lat']), crs=route_gdf.crs),
+                            DISTANCE_THRESHOLD_M)
+    section_paths = gpd.GeoDataFrame({'route_name_norm': pairs['route']}, geometry=geometry, crs=route_gdf.crs)
+    return section_index.assign(path_id=path_ids), section_paths
+
+
+def load_ic_sections(csv_path=CSV_PATH, ic_shp_path=IC_SHP_PATH, route_shp_path=ROUTE_SHP_PATH, workers=1):
+    """{'section_index': (道路名, 区間) → 始点・終点 IC の座標と path_id, 'section_paths': IC の間で切り出した路線の線}"""
+    sources = [csv_path, ic_shp_path, route_shp_path]
+    return store.load_cached('ic_section_index', sources,
+                             lambda: build_ic_section_index(csv_path, ic_shp_path, route_shp_path, workers),
+                             PIPELINE_VERSION)
+
+
+
+# --- 3. IC 付き区間シェープファイルと区間別件数表（roadkill-map.py 用） ---
+def build_section_shapes(sections_shp_path):
+    sections_gdf = gpd.read_file(sections_shp_path, encoding='utf-8').to_crs(epsg=4326)
+    sections_gdf['start_norm'] = normalize_section_names(sections_gdf[SHP_START_IC_COL].astype(str))
+    sections_gdf['end_norm'] = normalize_section_names(sections_gdf[SHP_END_IC_COL].astype(str))
+    sections_gdf = sections_gdf[sections_gdf.geometry.notna()].reset_index(drop=True)
+    # 向きによらない区間キーを整数 ID にする（CSV 側には match_section_ids で同じ ID を振る）
+    sections_gdf['section_id'], section_keys = build_section_keys(sections_gdf['start_norm'], sections_gdf['end_norm'])
+    sections_gdf['section_key'] = section_keys[sections_gdf['section_id']]
+    return {'sections': sections_gdf, 'section_keys': section_keys.to_frame(name='section_key', index=False)}
+
+
+def _map_tables(incidents, section_keys):
+    # 正式名称のある行に区間 ID を振り（一致しない区間は -1）、区間別の件数表などを作る
+    rows = incidents[incidents[CSV_OFFICIAL_NAME_COL].notna()].copy()
+    rows['section_id'] = match_section_ids(section_keys, rows['section_norm'])
+    counts = count_cells(rows, 'section_id', FILTER_COLS, attr_cols=[CSV_LENGTH_COL, CSV_ROUTE_NAME_COL])
+    # 件数表から作るキューブの区間別件数が、行の groupby と一致するかを作成時に一度だけ確かめる
+    # （アプリは件数表だけを読み、全行は持たない）
+    check_consistency(CountCube(counts, 'section_id', FILTER_COLS, sections=pd.RangeIndex(len(section_keys)), weight_col='件数'),
+                      rows, {})
+    return {
+        'incident_sections': rows[['section_id']],
+        'unmatched': unmatched_sections(rows, 'section_id', 'section_norm', CSV_ROUTE_NAME_COL),
+        'counts': counts,
+    }
+
+
+def build_map_sections(csv_path, sections_shp_path):
+    shapes = build_section_shapes(sections_shp_path)
+    return {**shapes, **_map_tables(load_incidents(csv_path), pd.Index(shapes['section_keys']['section_key']))}
+
+
+def sync_map_sections(csv_dir, sections_shp_path):
+    """csv_dir の新しい CSV の分だけ区間 ID を振り、件数表と結合できなかった区間の表に足し込む。
+
+    戻り値は load_map_sections と同じ形（incident_sections の索引は load_incidents の行番号）。
+    """
+    incident_store = sync_incidents(csv_dir)
+    shapes = store.load_cached('section_shapes', [sections_shp_path],
+                               lambda: build_section_shapes(sections_shp_path), PIPELINE_VERSION)
+    section_keys = pd.Index(shapes['section_keys']['section_key'])
+    map_store = ingest.PartStore('map_sections', csv_dir, store.source_fingerprint([sections_shp_path], PIPELINE_VERSION))
+    map_store.sync(
+        [(part['digest'], part['digest']) for part in incident_store.parts],
+        lambda digest: _map_tables(incident_store.read_part(digest, 'incidents'), section_keys),
+        aggregates={
+            'counts': lambda frames: merge_cells(frames, 'section_id', FILTER_COLS, attr_cols=[CSV_LENGTH_COL, CSV_ROUTE_NAME_COL]),
+            'unmatched': lambda frames: merge_unmatched(frames, 'section_norm', CSV_ROUTE_NAME_COL),
+        })
+    return {
+        **shapes,
+        'incident_sections': map_store.read_parts('incident_sections', incident_store.row_offsets()),
+        'unmatched': map_store.read_aggregate('unmatched'),
+        'counts': map_store.read_aggregate('counts'),
+    }
+
+
+def load_map_sections(csv_path=CSV_PATH, sections_shp_path=SECTIONS_SHP_PATH):
+    if os.path.isdir(csv_path) and store.feather is not None:
+        return sync_map_sections(csv_path, sections_shp_path)
+    return store.load_cached('map_sections', [csv_path, sections_shp_path],
+                             lambda: build_map_sections(csv_path, sections_shp_path), PIPELINE_VERSION)
+
+
+# --- 4. 複数年度の区間 × 月の件数（時系列表示用） ---
+def build_time_series(yearly_sources=YEARLY_SOURCES):
+    """年度ごとの CSV・区間シェープファイルを、向きによらない区間キーでそろえて 1 つの表にまとめる。
+
+    形状は区間キーを含む最も新しい年度のものを使う（同じキーの形状が複数あればすべて）。
+    戻り値の monthly は (section_id, period, 件数)、section_attrs は section_id 順の区間ごとの属性。
+    """
+    first_year = min(yearly_sources)
+    shapes, monthly, attrs = [], [], []
+    for year, (csv_path, sections_shp_path) in sorted(yearly_sources.items()):
+        year_shapes = build_section_shapes(sections_shp_path)
+        section_keys = pd.Index(year_shapes['section_keys']['section_key'])
+        incidents = load_incidents(csv_path)
+        rows = incidents[incidents[CSV_OFFICIAL_NAME_COL].notna()].copy()
+        section_ids = match_section_ids(section_keys, rows['section_norm'])
+        rows = rows[section_ids >= 0].assign(section_key=section_keys[section_ids[section_ids >= 0]])
+        rows['period'] = period_index(year, rows[CSV_MONTH_COL], first_year)
+        monthly.append(rows.groupby(['section_key', 'period']).size().rename('件数').reset_index())
+        attrs.append(rows.groupby('section_key')[[CSV_LENGTH_COL, CSV_ROUTE_NAME_COL]].first().assign(year=year))
+        shapes.append(year_shapes['sections'][['section_key', SHP_START_IC_COL, SHP_END_IC_COL, 'geometry']].assign(year=year))
+
+    sections = pd.concat(shapes, ignore_index=True)
+    years = sections.groupby('section_key')['year'].agg(first_year='min', last_year='max')
+    sections = sections[sections['year'] == sections['section_key'].map(years['last_year'])]
+    keys = pd.Index(sorted(sections['section_key'].unique()), name='section_key')
+    sections = gpd.GeoDataFrame(sections.drop(columns='year'), geometry='geometry', crs='EPSG:4326').reset_index(drop=True)
+    sections.insert(0, 'section_id', keys.get_indexer(sections['section_key']))
+
+    # 区間長・道路名は新しい年度の値を優先する
+    section_attrs = pd.concat(attrs[::-1]).groupby(level=0)[[CSV_LENGTH_COL, CSV_ROUTE_NAME_COL]].first()
+    section_attrs = years.join(section_attrs).reindex(keys).reset_index()
+    monthly = pd.concat(monthly, ignore_index=True)
+    monthly['section_id'] = keys.get_indexer(monthly['section_key'])
+    monthly = monthly[['section_id', 'period', '件数']]
+    return {'sections': sections, 'section_attrs': section_attrs, 'monthly': monthly}
+
+
+def load_time_series(yearly_sources=YEARLY_SOURCES):
+    sources = [path for year in sorted(yearly_sources) for path in yearly_sources[year]]
+    version = f'{PIPELINE_VERSION}:' + ','.join(map(str, sorted(yearly_sources)))
+    return store.load_cached('time_series', sources, lambda: build_time_series(yearly_sources), version)
+
+
+# --- コマンドライン ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ロードキルマップの中間データ（区間ジオメトリ表・件数表）を事前に作成する")
+    parser.add_argument('--csv', default=CSV_PATH, help="事故 CSV（月次 CSV を置いたディレクトリも可）")
+    parser.add_argument('--joint-shp', default=IC_SHP_PATH, help="N06-23_Joint.shp（IC の位置）")
+    parser.add_argument('--route-shp', default=ROUTE_SHP_PATH, help="N06-23_HighwaySection.shp（路線）")
+    parser.add_argument('--sections-shp', default=SECTIONS_SHP_PATH, help="IC 付き区間シェープファイル")
+    parser.add_argument('--municipalities', default=MUNICIPALITIES_PATH, help="地名検索に加える市区町村一覧（任意）")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="IC 照合のプロセス数")
+    parser.add_argument('--cache-dir', default=store.CACHE_DIR, help="中間データの保存先")
+    args = parser.parse_args(argv)
+    store.CACHE_DIR = args.cache_dir
+
+    incidents = load_incidents(args.csv)
+    ic_sections = load_ic_sections(args.csv, args.joint_shp, args.route_shp, args.workers)
+    section_index = ic_sections['section_index']
+    map_sections = load_map_sections(args.csv, args.sections_shp)
+    gazetteer = load_gazetteer(args.joint_shp, args.sections_shp, args.municipalities)
+    print(f"事故: {len(incidents)} 行（{schema.memory_usage_mb(incidents).sum():.1f} MB）")
+    print(f"IC 座標を解決した区間: {len(section_index)}（路線から切り出した線: {len(ic_sections['section_paths'])}）")
+    print(f"地図区間: {len(map_sections['sections'])}（結合できなかった CSV の区間: {len(map_sections['unmatched'])}）")
+    print(f"件数表: {len(map_sections['counts'])} セル")
+    print(f"地名索引: {len(gazetteer)} 件")
+    print(f"保存先: {os.path.abspath(args.cache_dir)}")
+
+
+if __name__ == '__main__':
+    main()
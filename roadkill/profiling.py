@@ -0,0 +1,109 @@
+"""描画 1 回分の処理段階ごとの所要時間・メモリ・行数の記録。
+
+    tracer = Tracer(enabled)
+    with tracer.span('フィルタ') as span:
+        filtered_df = filter_engine.apply(selections); span.rows = len(filtered_df)
+
+段階ごとに経過時間、最大 RSS の増分（resource があるとき）、tracemalloc のピーク増分（trace_memory のとき）、
+行数を記録し、logger 'roadkill.profiling' に JSON 1 行で出す。記録は frame() で表にできる。
+ログの設定がなければ（streamlit run のままなど）、有効にしたときに標準エラー出力へ INFO で出すハンドラを付ける。
+無効なときの span は何もしない共有のオブジェクトを返すだけなので、計測を残したままでよい。
+段階は入れ子にしない（tracemalloc のピークを段階ごとにリセットするため）。
+"""
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+import uuid
+
+import pandas as pd
+
+try:
+    import resource  # Unix のみ
+except ImportError:
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# 環境変数で常に有効にできる（アプリでは ?debug=1 でも有効になる）
+DEBUG_ENABLED = os.environ.get('ROADKILL_DEBUG', '0') != '0'
+TRACE_MEMORY = os.environ.get('ROADKILL_TRACE_MEMORY', '0') != '0'  # tracemalloc は全体が遅くなるので別に切り替える
+COLUMNS = ['段階', '時間_ms', '行数', 'RSS増分_MB', 'メモリピーク_MB']
+
+
+def _enable_logging():
+    # ハンドラがどこにもなければ、INFO が最後の手段のハンドラで捨てられないように標準エラー出力へのハンドラを付ける
+    if not logger.hasHandlers():
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(asctime)s %(name)s %(message)s'))
+        logger.addHandler(handler)
+    if logger.level == logging.NOTSET: logger.setLevel(logging.INFO)
+
+
+def _max_rss_mb():
+    if resource is None: return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / 2 ** 20 if sys.platform == 'darwin' else max_rss / 1024  # macOS はバイト、Linux は KB 単位
+
+
+class _NullSpan:
+    # 無効なときの span。行数などの代入も無視する
+    def __enter__(self): return self
+    def __exit__(self, *exc_info): return False
+    def __setattr__(self, name, value): pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    def __init__(self, tracer, name, rows):
+        self.tracer, self.name, self.rows = tracer, name, rows
+
+    def __enter__(self):
+        if tracemalloc.is_tracing():
+            self.traced_start = tracemalloc.get_traced_memory()[0]; tracemalloc.reset_peak()
+        self.rss_start = _max_rss_mb()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        rss = _max_rss_mb()
+        peak = tracemalloc.get_traced_memory()[1] - self.traced_start if tracemalloc.is_tracing() else None
+        self.tracer._record({
+            '段階': self.name,
+            '時間_ms': elapsed * 1000,
+            '行数': None if self.rows is None else int(self.rows),
+            'RSS増分_MB': None if rss is None else rss - self.rss_start,
+            'メモリピーク_MB': None if peak is None else peak / 2 ** 20,
+        }, failed=exc_type is not None)
+        return False
+
+
+class Tracer:
+    """描画 1 回分の段階の記録。enabled が偽なら何も記録しない。"""
+
+    def __init__(self, enabled=DEBUG_ENABLED, trace_memory=TRACE_MEMORY):
+        self.enabled = enabled
+        self.records = []
+        self.run_id = uuid.uuid4().hex[:8] if enabled else None
+        if enabled: _enable_logging()
+        if enabled and trace_memory and not tracemalloc.is_tracing(): tracemalloc.start()
+
+    def span(self, name, rows=None):
+        """name の段階を計る文脈。rows（行数）はあとから span.rows に入れてもよい。"""
+        return _Span(self, name, rows) if self.enabled else _NULL_SPAN
+
+    def _record(self, record, failed=False):
+        self.records.append(record)
+        logger.info(json.dumps({'event': 'span', 'run': self.run_id, 'failed': failed, **record}, ensure_ascii=False))
+
+    def frame(self):
+        """記録した段階の表（COLUMNS の列）。"""
+        return pd.DataFrame(self.records, columns=COLUMNS).astype({'行数': 'Int64'})
+
+    def total_ms(self):
+        return sum(record['時間_ms'] for record in self.records)
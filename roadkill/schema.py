@@ -0,0 +1,92 @@
+"""事故 CSV の列の型（スキーマ）と、チャンクごとの検証・結合。
+
+文字列の列はカテゴリ型、月・時は int8 で持つ。Python の文字列のまま持つより
+フレームが数分の一になり、Streamlit のレプリカごとにキャッシュされるコピーやディスクキャッシュも小さくなる。
+python -m roadkill.schema CSV で、型を指定しない読み込みとのメモリ使用量を比べられる。
+"""
+import argparse
+import logging
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from .config import (
+    CSV_PATH, CSV_OFFICIAL_NAME_COL, CSV_ROUTE_NAME_COL, CSV_SECTION_NAME_COL, CSV_DIRECTION_COL,
+    CSV_WEATHER_COL, CSV_ANIMAL_COL, CSV_MONTH_COL, CSV_HOUR_COL, CSV_DAY_OF_WEEK_COL, CSV_LENGTH_COL,
+)
+
+logger = logging.getLogger(__name__)
+
+CHUNK_ROWS = 200_000
+TEXT_COLS = [CSV_ROUTE_NAME_COL, CSV_OFFICIAL_NAME_COL, CSV_SECTION_NAME_COL, CSV_DIRECTION_COL,
+             CSV_WEATHER_COL, CSV_ANIMAL_COL, CSV_DAY_OF_WEEK_COL]
+# 整数の列: (型, 最小値, 最大値)。範囲外の行は除く
+INT_COLS = {CSV_MONTH_COL: ('int8', 1, 12), CSV_HOUR_COL: ('int8', 0, 23)}
+# 区間長は float64 のまま（float32 だと 11.2 が 11.1999998 になり、件/km の表示が丸めの境目で変わる）
+FLOAT_COLS = {CSV_LENGTH_COL: 'float64'}
+REQUIRED_COLS = [CSV_ROUTE_NAME_COL, CSV_SECTION_NAME_COL, CSV_DIRECTION_COL, CSV_LENGTH_COL]
+# read_csv に渡す型。文字列の列は型を推定させない（チャンク内がすべて空の列が float64 になり、
+# チャンクごとにカテゴリの型が変わって連結できなくなるため）
+CSV_DTYPES = {col: str for col in TEXT_COLS}
+
+
+def coerce_chunk(chunk):
+    """CSV の 1 チャンクを検証してスキーマの型にする。
+
+    必要な列の欠損、数値でない月・時・区間長、範囲外の月・時の行は除く。必要な列がなければ ValueError。
+    """
+    chunk.columns = chunk.columns.str.strip()
+    missing = [col for col in REQUIRED_COLS + list(INT_COLS) if col not in chunk.columns]
+    if missing: raise ValueError(f"CSV に必要な列がありません: {', '.join(missing)}")
+    chunk = chunk.dropna(subset=REQUIRED_COLS)
+    numeric = {col: pd.to_numeric(chunk[col], errors='coerce') for col in [*INT_COLS, *FLOAT_COLS]}
+    valid = np.logical_and.reduce([values.notna().to_numpy() for values in numeric.values()])
+    in_range = np.logical_and.reduce([numeric[col].between(low, high).to_numpy() for col, (_, low, high) in INT_COLS.items()])
+    if (valid & ~in_range).any(): logger.warning("範囲外の月・時の行を除きました: %d 行", int((valid & ~in_range).sum()))
+    keep = valid & in_range
+    chunk = chunk[keep].copy()
+    for col, (dtype, _, _) in INT_COLS.items():
+        chunk[col] = numeric[col][keep].astype(dtype)
+    for col, dtype in FLOAT_COLS.items():
+        chunk[col] = numeric[col][keep].astype(dtype)
+    # 列名の前後に空白があって CSV_DTYPES が効かなかった列も、文字列にしてからカテゴリにする（カテゴリの型をそろえる）
+    for col in TEXT_COLS:
+        if col in chunk.columns: chunk[col] = chunk[col].astype('str').astype('category')
+    return chunk
+
+
+def concat_frames(frames, ignore_index=False):
+    """pd.concat と同じだが、カテゴリ型の列はカテゴリをそろえてから結合する（そろえないと文字列の列に戻る）。"""
+    frames = list(frames)
+    if not frames: return None
+    dtypes = {col: pd.CategoricalDtype(union_categoricals([frame[col] for frame in frames], sort_categories=True).categories)
+              for col in frames[0].columns if all(isinstance(frame[col].dtype, pd.CategoricalDtype) for frame in frames)}
+    return pd.concat([frame.astype(dtypes) for frame in frames] if dtypes else frames, ignore_index=ignore_index)
+
+
+def memory_usage_mb(frame):
+    """列ごとのメモリ使用量（MB、文字列の中身も含む）。"""
+    return frame.memory_usage(deep=True, index=False) / 2 ** 20
+
+
+def main(argv=None):
+    from .pipeline import read_incidents
+    parser = argparse.ArgumentParser(description="事故 CSV を型を指定せずに読んだ場合とスキーマで読んだ場合のメモリ使用量を比べる")
+    parser.add_argument('csv', nargs='?', default=CSV_PATH, help="事故 CSV")
+    args = parser.parse_args(argv)
+
+    plain = pd.read_csv(args.csv, encoding='utf-8-sig', header=2)
+    plain.columns = plain.columns.str.strip()
+    compact = read_incidents(args.csv)
+    report = pd.DataFrame({'型指定なし_MB': memory_usage_mb(plain), 'スキーマ_MB': memory_usage_mb(compact)})
+    report = report.reindex(list(plain.columns) + [col for col in compact.columns if col not in plain.columns])
+    report['型'] = compact.dtypes.astype(str)
+    print(f"行数: {len(plain)} → {len(compact)}")
+    print(report.round(3).to_string())
+    before, after = report['型指定なし_MB'].sum(), report['スキーマ_MB'].sum()
+    print(f"合計: {before:.2f} MB → {after:.2f} MB（{after / before:.0%}）")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""始点・終点の向きによらない区間キーと整数の区間 ID。"""
+import pandas as pd
+
+SECTION_SEP = '〜'
+
+
+def undirected_section_key(start, end):
+    """始点・終点の名前を辞書順に並べて連結した、向きによらない区間キーを返す。"""
+    swap = start > end
+    return start.where(~swap, end) + SECTION_SEP + end.where(~swap, start)
+
+
+def split_section(section):
+    """「始点〜終点」を (始点, 終点) に分ける。区切りのない値は両方とも欠損にする。"""
+    parts = section.str.partition(SECTION_SEP)
+    has_sep = parts[1] == SECTION_SEP
+    return parts[0].where(has_sep), parts[2].where(has_sep)
+
+
+def match_section_ids(section_keys, csv_sections):
+    """CSV の「始点〜終点」を section_keys の位置（区間 ID）に変換する。一致しなければ -1。"""
+    csv_start, csv_end = split_section(csv_sections)
+    return section_keys.get_indexer(undirected_section_key(csv_start, csv_end))
+
+
+def build_section_keys(shp_start, shp_end):
+    """シェープファイル側の区間 ID（区間キーの出現順）と、ID 順の区間キーを返す。"""
+    shp_keys = undirected_section_key(shp_start, shp_end)
+    section_keys = pd.Index(shp_keys.unique())
+    return section_keys.get_indexer(shp_keys), section_keys
+
+
+def build_section_ids(shp_start, shp_end, csv_sections):
+    """シェープファイル側と CSV 側に、同じ整数の区間 ID を振る。
+
+    ID はシェープファイルの区間キーの出現順で、CSV 側で一致する区間がなければ -1。
+    戻り値は (シェープファイル側の ID, CSV 側の ID, ID 順の区間キー)。
+    """
+    shp_ids, section_keys = build_section_keys(shp_start, shp_end)
+    return shp_ids, match_section_ids(section_keys, csv_sections), section_keys
+
+
+def unmatched_sections(df, section_id_col, section_col, route_col, count_col='件数'):
+    """シェープファイルのどの区間とも結合できなかった CSV の区間を、件数の多い順に返す。"""
+    missed = df[df[section_id_col] < 0]
+    agg_funcs = {count_col: (section_col, 'size'), route_col: (route_col, 'first')}
+    return missed.groupby(section_col, observed=True).agg(**agg_funcs).sort_values(count_col, ascending=False).reset_index()
+
+
+def merge_unmatched(frames, section_col, route_col, count_col='件数'):
+    """unmatched_sections の結果をいくつか足し合わせる（路線名は先に出てきたものを使う）。"""
+    merged = pd.concat(frames, ignore_index=True)
+    agg_funcs = {count_col: (count_col, 'sum'), route_col: (route_col, 'first')}
+    return merged.groupby(section_col, observed=True).agg(**agg_funcs).sort_values(count_col, ascending=False).reset_index()
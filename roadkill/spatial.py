@@ -0,0 +1,103 @@
+"""空間索引を使った IC・路線の近接判定と、路線に沿った位置（線形参照）。"""
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from shapely import STRtree
+
+# 距離判定に使うメートル系の座標参照系（JGD2011 / UTM 54N。日本全域で誤差数%以内）
+METRIC_CRS = 'EPSG:6691'
+
+
+def find_route_ic_candidates(ic_gdf, sections_gdf, threshold_m, ic_name_col='ic_name_norm', route_col='route_name_norm'):
+    """路線ごとに、その路線の区間から threshold_m 以内にある IC を返す。
+
+    全 IC 点を路線区間の STRtree に一括で問い合わせるため、計算量は IC 近傍の区間数に比例する。
+    戻り値は {路線名: {IC名: [Point, ...]}}（Point は ic_gdf の元の座標系のまま）。
+    """
+    ic_metric = ic_gdf.geometry.to_crs(METRIC_CRS).values
+    section_metric = sections_gdf.geometry.to_crs(METRIC_CRS).values
+    tree = STRtree(section_metric)
+    ic_idx, section_idx = tree.query(ic_metric, predicate='dwithin', distance=threshold_m)
+
+    pairs = pd.DataFrame({
+        'ic': ic_idx,
+        'route': sections_gdf[route_col].to_numpy()[section_idx],
+    }).drop_duplicates()
+
+    candidates = {route: {} for route in sorted(sections_gdf[route_col].dropna().unique())}
+    ic_names = ic_gdf[ic_name_col].to_numpy()
+    ic_points = ic_gdf.geometry.to_numpy()
+    for route, ic in zip(pairs['route'], pairs['ic']):
+        if route not in candidates: continue
+        candidates[route].setdefault(ic_names[ic], []).append(ic_points[ic])
+    return candidates
+
+
+def linear_reference(geoseries, routes):
+    """各区間を、同じ路線の区間をつないだ線の上の範囲 [start_km, end_km] に対応付ける。
+
+    路線の形状が途切れているとつないだ線が複数になるので、区間の中点に最も近い線を使う。
+    戻り値は geoseries と同じ索引の DataFrame（line: 路線・線ごとの通し番号, start_km, end_km, length_km）。
+    """
+    metric = geoseries.to_crs(METRIC_CRS).values
+    routes = np.asarray(routes)
+    line = np.zeros(len(metric), dtype=np.int64)
+    start, end = np.zeros(len(metric)), np.zeros(len(metric))
+    line_offset = 0
+    for route in pd.unique(routes):
+        rows = np.flatnonzero(routes == route)
+        parts = shapely.get_parts(shapely.line_merge(shapely.union_all(metric[rows])))
+        # 区間の端点は最初と最後の頂点（MultiLineString は最初の線の始点と最後の線の終点）
+        coords, owner = shapely.get_coordinates(metric[rows], return_index=True)
+        first = np.r_[0, np.flatnonzero(np.diff(owner)) + 1]
+        last = np.r_[first[1:] - 1, len(owner) - 1]
+        midpoints = shapely.line_interpolate_point(metric[rows], 0.5, normalized=True)
+        nearest = shapely.distance(parts[None, :], midpoints[:, None]).argmin(axis=1)
+        a = shapely.line_locate_point(parts[nearest], shapely.points(coords[first]))
+        b = shapely.line_locate_point(parts[nearest], shapely.points(coords[last]))
+        line[rows] = line_offset + nearest
+        start[rows], end[rows] = np.minimum(a, b) / 1000, np.maximum(a, b) / 1000
+        line_offset += len(parts)
+    return pd.DataFrame({'line': line, 'start_km': start, 'end_km': end, 'length_km': shapely.length(metric) / 1000},
+                        index=geoseries.index)
+
+
+def _clip_part(coords, cumulative, a, b):
+    # 1 本の線（頂点 coords、始点からの距離 cumulative）の a〜b の部分。a > b なら逆向き
+    lo, hi = min(a, b), max(a, b)
+    inner = coords[(cumulative > lo) & (cumulative < hi)]
+    ends = np.column_stack([np.interp([lo, hi], cumulative, coords[:, 0]), np.interp([lo, hi], cumulative, coords[:, 1])])
+    clipped = np.vstack([ends[:1], inner, ends[1:]])
+    return clipped[::-1] if a > b else clipped
+
+
+def clip_between(lines, line_routes, pair_routes, start_points, end_points, max_distance_m):
+    """路線の線を、組ごとの始点・終点（IC）の間で切り出す。
+
+    路線ごとに lines をつなぎ、始点・終点からの距離の和が最小の線の上で両端の位置を求めて、その間を切り出す。
+    どちらかの点が線から max_distance_m より遠い組、路線の線がない組は始点と終点を結ぶ直線にする。
+    lines と start_points・end_points は同じ座標参照系の GeoSeries。
+    戻り値は組の順の LineString の配列（元の座標参照系、始点から終点の向き）。
+    """
+    lines_metric = lines.to_crs(METRIC_CRS).to_numpy()
+    starts = start_points.to_crs(METRIC_CRS).to_numpy()
+    ends = end_points.to_crs(METRIC_CRS).to_numpy()
+    line_routes, pair_routes = np.asarray(line_routes), np.asarray(pair_routes)
+    if not len(starts): return np.array([], dtype=object)
+    clipped = shapely.linestrings(np.stack([shapely.get_coordinates(starts), shapely.get_coordinates(ends)], axis=1))
+    for route in pd.unique(pair_routes):
+        pairs, rows = np.flatnonzero(pair_routes == route), np.flatnonzero(line_routes == route)
+        if not len(rows): continue
+        parts = shapely.get_parts(shapely.line_merge(shapely.union_all(lines_metric[rows])))
+        start_dist = shapely.distance(parts[None, :], starts[pairs, None])
+        end_dist = shapely.distance(parts[None, :], ends[pairs, None])
+        nearest = (start_dist + end_dist).argmin(axis=1)
+        within = np.maximum(start_dist, end_dist)[np.arange(len(pairs)), nearest] <= max_distance_m
+        a = shapely.line_locate_point(parts[nearest], starts[pairs])
+        b = shapely.line_locate_point(parts[nearest], ends[pairs])
+        part_coords = [shapely.get_coordinates(part) for part in parts]
+        cumulative = [np.r_[0, np.cumsum(np.hypot(*np.diff(coords, axis=0).T))] for coords in part_coords]
+        for pair, part, a_m, b_m, ok in zip(pairs, nearest, a, b, within):
+            if ok and a_m != b_m: clipped[pair] = shapely.linestrings(_clip_part(part_coords[part], cumulative[part], a_m, b_m))
+    return gpd.GeoSeries(clipped, crs=METRIC_CRS).to_crs(lines.crs).to_numpy()
@@ -0,0 +1,116 @@
+"""前処理済みデータのディスクキャッシュ（Arrow/Feather 形式、ジオメトリは WKB）。
+
+入力ファイルのサイズ・更新時刻からキーを作り、変わっていれば自動で作り直す。
+プロセスをまたいで有効なので、再起動や新しいレプリカでも CSV・シェープファイルの解析をやり直さずに済む。
+ファイルはメモリマップで読み、欠損のない数値の列はコピーせずにそのまま使う（読み取り専用）。
+同じキャッシュを読むワーカープロセスどうしは OS のページキャッシュを共有するので、その分のメモリは増えない。
+キーのディレクトリが版の印で、作り直しは一時ディレクトリからの名前の変更で一度に入れ替わる。
+
+アプリでは source_fingerprint を source_key として、読み込んだデータやエンジンを
+st.cache_resource(max_entries=1) に置く。変更しないオブジェクトなので全セッションが同じものを共有し
+（st.cache_data は呼び出しのたびに複製を返す）、入力ファイルが変わって source_key が変わったら古い版は捨てる。
+CSV_PATH に月次 CSV を置いたディレクトリを指定した場合は、新しいファイルの分だけが取り込まれる（roadkill.ingest）。
+"""
+import hashlib
+import logging
+import os
+import shutil
+import uuid
+
+import geopandas as gpd
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:  # pyarrow がなければキャッシュせず毎回作る
+    pa = feather = None
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.environ.get('ROADKILL_CACHE_DIR', '.roadkill_cache')
+SHAPEFILE_SIDECARS = ('.shx', '.dbf', '.prj', '.cpg')
+
+
+def _source_files(path):
+    # ディレクトリ（月次 CSV の置き場）は中の CSV すべて
+    if os.path.isdir(path):
+        return sorted(os.path.join(path, file) for file in os.listdir(path) if file.lower().endswith('.csv'))
+    files = [path]
+    root, ext = os.path.splitext(path)
+    if ext.lower() == '.shp':
+        files += [root + sidecar for sidecar in SHAPEFILE_SIDECARS if os.path.exists(root + sidecar)]
+    return files
+
+
+def source_fingerprint(sources, version=1):
+    """入力ファイル（シェープファイルは付属ファイル、ディレクトリは中の CSV も含む）のサイズ・更新時刻から作るキャッシュキー。"""
+    digest = hashlib.sha1(f'v{version}'.encode())
+    for path in sources:
+        for file in _source_files(path):
+            stat = os.stat(file)
+            digest.update(f'{os.path.abspath(file)}:{stat.st_size}:{stat.st_mtime_ns}'.encode())
+    return digest.hexdigest()[:16]
+
+
+def source_id(sources):
+    """入力ファイルのパスだけから作る識別子（内容が変わっても変わらない）。同じ入力の古い版のキャッシュを選ぶのに使う。"""
+    return hashlib.sha1('\n'.join(os.path.abspath(path) for path in sources).encode()).hexdigest()[:8]
+
+
+def write_frame(frame, path):
+    """frame を path に保存する。一時ファイルに書いてから置き換えるので、読む側が書きかけのファイルを見ることはない。"""
+    tmp_path = f'{path}.tmp-{uuid.uuid4().hex}'
+    try:
+        if isinstance(frame, gpd.GeoDataFrame):
+            frame.to_feather(tmp_path, compression='uncompressed')
+        else:
+            # 1 つのレコードバッチにしておくと、読むときに列を連結せず（コピーせず）に済む
+            feather.write_feather(pa.Table.from_pandas(frame), tmp_path, compression='uncompressed', chunksize=max(len(frame), 1))
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path): os.remove(tmp_path)
+
+
+def read_frame(path):
+    table = feather.read_table(path, memory_map=True)
+    if b'geo' in (table.schema.metadata or {}):
+        return gpd.read_feather(path)
+    # 列ごとに別のブロックにすると、欠損のない数値の列はメモリマップ上の配列を参照するだけになる
+    return table.to_pandas(split_blocks=True)
+
+
+def load_cached(name, sources, build, version=1):
+    """保存済みのフレームがあれば読み、なければ build() で作って保存する。
+
+    build は {名前: DataFrame または GeoDataFrame} を返す関数。保存は一時ディレクトリに書いてから
+    名前を変えるので、同時に起動した別プロセスが書きかけのキャッシュを読むことはない。
+    キャッシュは name/<入力パスの識別子>-<キー> に置き、保存後は同じ入力パスの古いキーだけを消す
+    （同じ name で別の入力、たとえば年度ごとの CSV のキャッシュは残す）。
+    """
+    if feather is None: return build()
+    prefix = source_id(sources)
+    key = f'{prefix}-{source_fingerprint(sources, version)}'
+    cache_dir = os.path.join(CACHE_DIR, name, key)
+    if os.path.isdir(cache_dir):
+        try:
+            return {file[:-len('.feather')]: read_frame(os.path.join(cache_dir, file))
+                    for file in sorted(os.listdir(cache_dir)) if file.endswith('.feather')}
+        except FileNotFoundError:  # 読んでいる間に別のプロセスが新しい版に入れ替えて消した
+            logger.info("前処理キャッシュが入れ替わったため作り直します（%s）", name)
+
+    frames = build()
+    tmp_dir = f'{cache_dir}.tmp-{uuid.uuid4().hex}'
+    try:
+        os.makedirs(tmp_dir)
+        for frame_name, frame in frames.items():
+            write_frame(frame, os.path.join(tmp_dir, f'{frame_name}.feather'))
+        os.rename(tmp_dir, cache_dir)
+    except (OSError, pa.ArrowException, ValueError, TypeError) as e:
+        logger.warning("前処理キャッシュを保存できませんでした（%s）: %s", name, e)
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return frames
+    # 同じ入力パスの古いキーのキャッシュは消す
+    for entry in os.listdir(os.path.join(CACHE_DIR, name)):
+        if entry.startswith(f'{prefix}-') and entry != key and '.tmp-' not in entry:
+            shutil.rmtree(os.path.join(CACHE_DIR, name, entry), ignore_errors=True)
+    return frames
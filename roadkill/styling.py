@@ -0,0 +1,47 @@
+"""地図レイヤの密度・色・ツールチップを、区間単位のループなしでまとめて計算する。"""
+from string import Formatter
+
+import matplotlib
+import numpy as np
+import pandas as pd
+
+
+def density_per_km(counts, lengths):
+    """件数 / 区間長。区間長が 0 以下・欠損の区間は 0 にする。"""
+    counts = np.asarray(counts, dtype=float)
+    lengths = np.asarray(lengths, dtype=float)
+    density = np.zeros_like(counts)
+    np.divide(counts, lengths, out=density, where=lengths > 0)
+    return density
+
+
+def density_colors(density, max_value, cmap_name='coolwarm', alpha=200, zero_color=None):
+    """密度の配列を、カラーマップ 1 回の呼び出しで uint8 の RGBA 配列（行数 × 4）にする。"""
+    density = np.asarray(density, dtype=float)
+    cmap = matplotlib.colormaps[cmap_name]
+    rgba = cmap(density / (max_value if max_value > 0 else 1), bytes=True)
+    rgba[:, 3] = alpha
+    if zero_color is not None: rgba[density <= 0] = zero_color
+    return rgba
+
+
+def change_colors(change, max_abs, cmap_name='coolwarm', alpha=200, nan_color=None):
+    """増減率など 0 を中心とする値を、-max_abs〜+max_abs をカラーマップの両端として RGBA 配列にする。"""
+    change = np.asarray(change, dtype=float)
+    cmap = matplotlib.colormaps[cmap_name]
+    rgba = cmap((change / (max_abs if max_abs > 0 else 1) + 1) / 2, bytes=True)
+    rgba[:, 3] = alpha
+    if nan_color is not None: rgba[np.isnan(change)] = nan_color
+    return rgba
+
+
+def render_template(template, df):
+    """「{列名}」「{列名:.2f}」を含むテンプレートを、列単位の文字列演算で行ごとに展開する。"""
+    result = pd.Series('', index=df.index, dtype=object)
+    for literal, field, spec, _ in Formatter().parse(template):
+        if literal: result = result + literal
+        if field is None: continue
+        values = df[field].to_numpy()
+        text = np.char.mod(f'%{spec}', values) if spec else values.astype(str)
+        result = result + pd.Series(text, index=df.index, dtype=object)
+    return result
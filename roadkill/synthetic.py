@@ -0,0 +1,116 @@
+"""ベンチマーク用の合成データ（事故 CSV と、路線・IC・IC 付き区間のシェープファイル）。
+
+列名・ファイルの形式は同梱データと同じなので、パイプラインやアプリの処理をそのまま流せる。
+路線は日本付近の範囲をランダムに進む折れ線で、IC はその折れ点、区間は隣り合う IC の間。
+"""
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+from .config import (
+    CSV_OFFICIAL_NAME_COL, CSV_ROUTE_NAME_COL, CSV_SECTION_NAME_COL, CSV_DIRECTION_COL,
+    CSV_WEATHER_COL, CSV_ANIMAL_COL, CSV_MONTH_COL, CSV_HOUR_COL, CSV_DAY_OF_WEEK_COL, CSV_LENGTH_COL,
+    IC_NAME_COL, ROUTE_NAME_COL, SHP_START_IC_COL, SHP_END_IC_COL,
+)
+from .sections import SECTION_SEP
+
+CRS = 'EPSG:6668'  # 同梱のシェープファイルと同じ JGD2011
+LON_RANGE, LAT_RANGE = (130.0, 145.0), (31.0, 44.0)
+WEATHERS = ['晴', '曇', '雨', '雪', '霧']
+ANIMALS = ['タヌキ', 'ネコ', 'イヌ', 'シカ', 'キツネ', 'ハクビシン', 'カラス', 'イノシシ', 'ウサギ', 'その他']
+DAYS_OF_WEEK = ['月', '火', '水', '木', '金', '土', '日']
+CSV_COLUMNS = [CSV_ROUTE_NAME_COL, CSV_OFFICIAL_NAME_COL, CSV_SECTION_NAME_COL, CSV_DIRECTION_COL, CSV_WEATHER_COL,
+               CSV_ANIMAL_COL, CSV_MONTH_COL, CSV_HOUR_COL, CSV_DAY_OF_WEEK_COL, CSV_LENGTH_COL]
+
+
+def make_network(n_routes=50, ics_per_route=30, vertices_per_section=4, seed=0):
+    """合成の道路網。戻り値は {'routes': 路線（区間ごと）, 'joints': IC の点, 'sections': IC 付き区間} の GeoDataFrame。"""
+    rng = np.random.default_rng(seed)
+    route_names = [f'合成{r:03d}号自動車道' for r in range(n_routes)]
+    starts = np.column_stack([rng.uniform(*LON_RANGE, n_routes), rng.uniform(*LAT_RANGE, n_routes)])
+    # 向きを少しずつ変えながら 0.05〜0.15 度ずつ進む
+    headings = rng.uniform(0, 2 * np.pi, n_routes)[:, None] + np.cumsum(rng.normal(0, 0.3, (n_routes, ics_per_route - 1)), axis=1)
+    steps = rng.uniform(0.05, 0.15, (n_routes, ics_per_route - 1))
+    offsets = np.stack([np.cos(headings) * steps, np.sin(headings) * steps], axis=2)
+    ic_coords = np.concatenate([starts[:, None, :], starts[:, None, :] + np.cumsum(offsets, axis=1)], axis=1)
+
+    ic_names = np.array([[f'合成{r:03d}-{k:03d}' for k in range(ics_per_route)] for r in range(n_routes)])
+    section_lines = []
+    for r in range(n_routes):
+        for k in range(ics_per_route - 1):
+            t = np.linspace(0, 1, vertices_per_section + 2)[:, None]
+            line = ic_coords[r, k] + t * (ic_coords[r, k + 1] - ic_coords[r, k])
+            line[1:-1] += rng.normal(0, 0.005, (vertices_per_section, 2))
+            section_lines.append(shapely.linestrings(line))
+    route_col = np.repeat(route_names, ics_per_route - 1)
+    start_names = ic_names[:, :-1].ravel()
+    end_names = ic_names[:, 1:].ravel()
+
+    joints = gpd.GeoDataFrame({IC_NAME_COL: ic_names.ravel(), ROUTE_NAME_COL: np.repeat(route_names, ics_per_route)},
+                              geometry=shapely.points(ic_coords.reshape(-1, 2)), crs=CRS)
+    routes = gpd.GeoDataFrame({ROUTE_NAME_COL: route_col}, geometry=section_lines, crs=CRS)
+    sections = gpd.GeoDataFrame({ROUTE_NAME_COL: route_col,
+                                 SHP_START_IC_COL: np.char.add(start_names.astype(str), 'IC'),
+                                 SHP_END_IC_COL: np.char.add(end_names.astype(str), 'IC')},
+                                geometry=section_lines, crs=CRS)
+    return {'routes': routes, 'joints': joints, 'sections': sections}
+
+
+def incident_rows(sections, n_rows, seed=0, missing_official=0.05):
+    """sections（make_network の 'sections'）の区間に事故を割り振った、事故 CSV と同じ列の DataFrame。
+
+    区間ごとの件数の偏りはジップ分布に近い重みで付ける（一部の区間に集中する）。
+    """
+    rng = np.random.default_rng(seed)
+    n_sections = len(sections)
+    weights = 1 / np.arange(1, n_sections + 1) ** 0.8
+    weights = rng.permutation(weights / weights.sum())
+    picks = rng.choice(n_sections, size=n_rows, p=weights)
+    lengths_km = np.round(sections.to_crs('EPSG:6691').length.to_numpy() / 1000, 1)
+    starts, ends = sections[SHP_START_IC_COL].to_numpy(), sections[SHP_END_IC_COL].to_numpy()
+    labels = np.char.add(np.char.add(starts.astype(str), SECTION_SEP), ends.astype(str))
+    routes = sections[ROUTE_NAME_COL].to_numpy()
+    official = routes[picks].astype(object)
+    official[rng.random(n_rows) < missing_official] = None
+    return pd.DataFrame({
+        CSV_ROUTE_NAME_COL: routes[picks],
+        CSV_OFFICIAL_NAME_COL: official,
+        CSV_SECTION_NAME_COL: labels[picks],
+        CSV_DIRECTION_COL: rng.choice(['上', '下'], n_rows),
+        CSV_WEATHER_COL: rng.choice(WEATHERS, n_rows, p=[0.45, 0.3, 0.18, 0.05, 0.02]),
+        CSV_ANIMAL_COL: rng.choice(ANIMALS, n_rows),
+        CSV_MONTH_COL: rng.integers(1, 13, n_rows),
+        CSV_HOUR_COL: rng.integers(0, 24, n_rows),
+        CSV_DAY_OF_WEEK_COL: rng.choice(DAYS_OF_WEEK, n_rows),
+        CSV_LENGTH_COL: lengths_km[picks],
+    }, columns=CSV_COLUMNS)
+
+
+def write_incident_csv(path, sections, n_rows, seed=0, chunk_rows=1_000_000):
+    """事故 CSV を書く（同梱 CSV と同じく 2 行の前置きのあとに見出し行）。大きな行数でも chunk_rows 行ずつ書く。"""
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        f.write('路上障害物（合成データ）\r\n集計期間: 合成\r\n')
+        for i, start in enumerate(range(0, n_rows, chunk_rows)):
+            chunk = incident_rows(sections, min(chunk_rows, n_rows - start), seed=seed + i)
+            chunk.to_csv(f, index=False, header=(i == 0), lineterminator='\r\n')
+    return path
+
+
+def write_dataset(directory, n_rows, n_routes=50, ics_per_route=30, seed=0):
+    """directory に合成の事故 CSV と 3 つのシェープファイルを書き、パスを返す（キーは pipeline の引数名に合わせる）。"""
+    os.makedirs(directory, exist_ok=True)
+    network = make_network(n_routes, ics_per_route, seed=seed)
+    paths = {
+        'csv_path': os.path.join(directory, f'incidents_{n_rows}.csv'),
+        'ic_shp_path': os.path.join(directory, 'joints.shp'),
+        'route_shp_path': os.path.join(directory, 'routes.shp'),
+        'sections_shp_path': os.path.join(directory, 'sections.shp'),
+    }
+    network['joints'].to_file(paths['ic_shp_path'], encoding='utf-8')
+    network['routes'].to_file(paths['route_shp_path'], encoding='utf-8')
+    network['sections'].to_file(paths['sections_shp_path'], encoding='utf-8')
+    write_incident_csv(paths['csv_path'], network['sections'], n_rows, seed=seed)
+    return paths
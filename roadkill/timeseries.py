@@ -0,0 +1,73 @@
+"""区間 × 月の件数時系列（複数年度）。
+
+年度ごとに区間の形状が変わっても、向きによらない IC の組の区間キーが同じなら同じ区間として扱う。
+件数は (区間, 月) の密な行列で持ち、移動合計・前年比は全区間・全期間を累積和の差でまとめて求めるので、
+スライダーで期間を動かしたときは行列の列を 1 本取り出すだけになる。
+"""
+import numpy as np
+
+from .styling import density_per_km
+
+FISCAL_YEAR_START_MONTH = 4  # 年度は 4 月始まり
+MONTHS_PER_YEAR = 12
+
+
+def period_index(fiscal_years, months, first_year, start_month=FISCAL_YEAR_START_MONTH):
+    """(年度, 月) を first_year 年度の最初の月からの通し番号にする。"""
+    return ((np.asarray(fiscal_years) - first_year) * MONTHS_PER_YEAR
+            + (np.asarray(months) - start_month) % MONTHS_PER_YEAR)
+
+
+def period_labels(first_year, n_periods, start_month=FISCAL_YEAR_START_MONTH):
+    """通し番号 0..n_periods-1 の月を「2023-04」の形の文字列にする（西暦の年・月）。"""
+    offsets = np.arange(n_periods) + start_month - 1
+    return [f'{first_year + offset // MONTHS_PER_YEAR}-{offset % MONTHS_PER_YEAR + 1:02d}' for offset in offsets]
+
+
+class SectionTimeSeries:
+    """区間 × 月の件数行列と、そこから求める移動合計・密度・前年比。
+
+    section_ids・periods・counts は同じ長さの配列（疎な形の件数）で、行列は (n_sections, 年数 × 12)。
+    lengths は区間ごとの区間長（km、不明は欠損）。
+    """
+
+    def __init__(self, section_ids, periods, counts, n_sections, first_year, n_years, lengths):
+        self.first_year, self.n_years = first_year, n_years
+        self.n_periods = n_years * MONTHS_PER_YEAR
+        flat = np.asarray(section_ids, dtype=np.int64) * self.n_periods + np.asarray(periods, dtype=np.int64)
+        self.counts = np.bincount(flat, weights=counts, minlength=n_sections * self.n_periods).reshape(n_sections, self.n_periods)
+        self.lengths = np.asarray(lengths, dtype=float)
+        self.labels = period_labels(first_year, self.n_periods)
+
+    def rolling_sum(self, window=MONTHS_PER_YEAR):
+        """各月までの window か月の合計。窓が最初の月より前にかかる月は欠損。"""
+        cumulative = np.zeros((self.counts.shape[0], self.n_periods + 1))
+        np.cumsum(self.counts, axis=1, out=cumulative[:, 1:])
+        rolling = np.full(self.counts.shape, np.nan)
+        rolling[:, window - 1:] = cumulative[:, window:] - cumulative[:, :-window]
+        return rolling
+
+    def rolling_density(self, window=MONTHS_PER_YEAR):
+        """rolling_sum / 区間長（件/km）。区間長が不明な区間は 0、窓が足りない月は欠損。"""
+        rolling = self.rolling_sum(window)
+        density = density_per_km(np.nan_to_num(rolling), np.broadcast_to(self.lengths[:, None], rolling.shape))
+        density[np.isnan(rolling)] = np.nan
+        return density
+
+    def yoy_change(self, window=MONTHS_PER_YEAR):
+        """各月までの window か月の合計の、12 か月前の同じ合計に対する増減率（%）。前が 0 件なら欠損。"""
+        rolling = self.rolling_sum(window)
+        change = np.full(rolling.shape, np.nan)
+        previous, current = rolling[:, :-MONTHS_PER_YEAR], rolling[:, MONTHS_PER_YEAR:]
+        np.divide(current - previous, previous, out=change[:, MONTHS_PER_YEAR:], where=previous > 0)
+        return change * 100
+
+    def yearly_totals(self):
+        """(区間, 年度) ごとの件数。"""
+        return self.counts.reshape(-1, self.n_years, MONTHS_PER_YEAR).sum(axis=2)
+
+    @classmethod
+    def from_frames(cls, monthly, section_attrs, first_year, n_years, length_col='区間長_km'):
+        """load_time_series の monthly（section_id, period, 件数）と section_attrs から作る。"""
+        return cls(monthly['section_id'].to_numpy(), monthly['period'].to_numpy(), monthly['件数'].to_numpy(),
+                   len(section_attrs), first_year, n_years, section_attrs[length_col].to_numpy())
@@ -0,0 +1,79 @@
+"""roadkill.normalize が従来の実装と同じ結果を返すことの確認。
+
+python -m pytest tests/test_normalize.py（同梱のシェープファイルがあれば、その名前もすべて確かめる）
+"""
+import os
+
+import pandas as pd
+import pytest
+
+from roadkill.normalize import normalize_name, normalize_names, normalize_section_name, normalize_section_names
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 同梱データのうち名前を含むファイルと列
+BUNDLED_NAME_SOURCES = [
+    ('高速道路時系列（令和5年度）/utf8/N06-23_Joint.shp', ['N06_018']),
+    ('高速道路時系列（令和5年度）/utf8/N06-23_HighwaySection.shp', ['N06_007']),
+    ('final_highway_sections_with_ic.shp', ['N06_007', 'start_IC', 'end_IC']),
+]
+# 接尾辞を消すと新しい接尾辞ができる名前、全角・空白・欠損など
+EDGE_CASES = ['PICA', '東SICA', 'SJCTA', 'SIC', '郡山ＪＣＴ', '仙台宮城ＩＣ', '　川口ＪＣＴ　', 'TBIC', 'JICCT',
+              '東北縦貫自動車道', '北海道縦貫自動車道', '道央道', '', None, float('nan'), 1]
+
+
+# --- 従来の実装 ---
+def _reference_normalize_name(name, is_route=False):
+    if not isinstance(name, str): return ""
+    name = name.translate(str.maketrans({chr(0xFF01 + i): chr(0x21 + i) for i in range(94)}))
+    name = name.replace('　', ' ')
+    if is_route:
+        if name.endswith('道'): name = name.replace('道', '')
+        return name.strip()
+    else:
+        suffixes = ['ＩＣ', 'IC', 'ＪＣＴ', 'JCT', 'ＳＩＣ', 'SIC', 'ＳＡ', 'SA', 'ＰＡ', 'PA', 'ＴＢ', 'TB']
+        for suffix in suffixes: name = name.replace(suffix, '')
+        return name.strip()
+
+def _reference_normalize_section_name(name):
+    if not isinstance(name, str): return ""
+    name = name.translate(str.maketrans({chr(0xFF01 + i): chr(0x21 + i) for i in range(94)}))
+    name = name.replace('　', ' ')
+    return name.strip()
+
+
+def find_mismatches(names):
+    """names のうち、スカラー版・ベクトル版のどちらかが従来の実装と異なる結果になるものを返す。"""
+    names = pd.Series(list(names), dtype=object)
+    checks = [
+        (lambda x: _reference_normalize_name(x), normalize_name, normalize_names),
+        (lambda x: _reference_normalize_name(x, is_route=True), lambda x: normalize_name(x, is_route=True),
+         lambda s: normalize_names(s, is_route=True)),
+        (_reference_normalize_section_name, normalize_section_name, normalize_section_names),
+    ]
+    mismatches = set()
+    for reference, scalar, vectorized in checks:
+        expected = [reference(name) for name in names]
+        mismatches.update(name for name, want in zip(names, expected) if scalar(name) != want)
+        mismatches.update(name for name, want, got in zip(names, expected, vectorized(names)) if got != want)
+    return sorted(mismatches, key=str)
+
+
+def _bundled_names():
+    gpd = pytest.importorskip('geopandas')
+    names = set()
+    for path, columns in BUNDLED_NAME_SOURCES:
+        path = os.path.join(ROOT, path)
+        if not os.path.exists(path): continue
+        frame = gpd.read_file(path, encoding='utf-8', ignore_geometry=True)
+        for col in columns:
+            names.update(frame[col].dropna())
+    if not names: pytest.skip("同梱のシェープファイルがありません")
+    return names
+
+
+def test_edge_cases_match_reference():
+    assert find_mismatches(EDGE_CASES) == []
+
+
+def test_bundled_names_match_reference():
+    assert find_mismatches(_bundled_names()) == []